@@ -0,0 +1,42 @@
+import math
+from datetime import datetime
+
+
+# name: (duration in seconds, speed in km/h)
+FIXTURES = {
+    'run_30min': (30 * 60, 11),
+    'run_2h': (2 * 3600, 10),
+    'ride_4h': (4 * 3600, 28),
+    'ride_10h': (10 * 3600, 25),
+}
+
+START_DATE_TIME = datetime(2024, 7, 20, 9, 17, 31)
+
+
+def make_activity(activity_id, duration, speed, start_date_time=START_DATE_TIME, lat=51.95, lon=4.21):
+    """
+    Builds synthetic activity and activity_streams rows.
+
+    The route is a wide loop travelled at a constant speed with one sample per
+    second, stored the way the streams table stores it.
+
+    Returns:
+    Tuple (activity, activity_streams) rows.
+    """
+    radius = speed * duration / 3600 / (2 * math.pi) / 111.0
+    times = []
+    latlngs = []
+    for second in range(0, duration + 1):
+        angle = 2 * math.pi * second / duration
+        times.append(str(second))
+        latlngs.append(f'[{lat + radius * math.sin(angle):.6f}, {lon + 1.6 * radius * (1 - math.cos(angle)):.6f}]')
+
+    activity = [0] * 12
+    activity[0] = activity_id
+    activity[9] = start_date_time
+    activity_streams = [0] * 8
+    activity_streams[0] = activity_id
+    activity_streams[1] = activity_id
+    activity_streams[2] = ','.join(times)
+    activity_streams[5] = ','.join(latlngs)
+    return tuple(activity), tuple(activity_streams)
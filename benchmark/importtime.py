@@ -0,0 +1,77 @@
+"""
+Import time check for the handler module, based on python -X importtime.
+
+Imports the module in a fresh interpreter a few times, reports the best
+cumulative import time and the slowest imports as json, and exits with 1 when
+the time is over budget or when a lazily loaded client got imported:
+
+    python -m benchmark.importtime --budget 250
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Clients that must only be imported on first use
+LAZY_MODULES = ['boto3', 'botocore', 'mysql.connector', 'requests']
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(module):
+    """
+    Imports module in a fresh interpreter.
+
+    Returns:
+    Tuple (cumulative microseconds of module, {imported module: cumulative microseconds}).
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                             capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=ROOT))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+
+    imports = {}
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            imports[match.group(4)] = int(match.group(2))
+    return imports[module], imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='src.main')
+    parser.add_argument('--budget', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', 250)),
+                        help='maximum import time in milliseconds (IMPORT_BUDGET_MS)')
+    parser.add_argument('--runs', type=int, default=5, help='the fastest run is compared with the budget')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to report')
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    best, imports = min(runs, key=lambda run: run[0])
+    eager = [module for module in LAZY_MODULES if module in imports]
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    report = {
+        "module": args.module,
+        "import_ms": round(best / 1000, 1),
+        "budget_ms": args.budget,
+        "eager_clients": eager,
+        "slowest": [{"module": module, "cumulative_ms": round(value / 1000, 1)} for module, value in slowest]
+    }
+    print(json.dumps(report, indent=2))
+
+    if best / 1000 > args.budget:
+        print(f"Import of {args.module} takes {best / 1000:.1f} ms, budget is {args.budget} ms", file=sys.stderr)
+        sys.exit(1)
+    if len(eager) > 0:
+        print(f"Import of {args.module} loads {', '.join(eager)} eagerly", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
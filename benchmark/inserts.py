@@ -0,0 +1,95 @@
+"""
+Insert throughput benchmark for Connection.insert against a real MySQL server.
+
+Creates a scratch table, writes synthetic weather rows with every insert mode
+and reports rows/s and MB/s as json. The connection settings come from
+DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and DB_NAME; the load mode also needs
+DB_LOCAL_INFILE=on and local_infile enabled on the server:
+
+    python -m benchmark.inserts --rows 2000 --samples 3600
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Connection  # noqa: E402
+
+COLUMNS = ['temp', 'wet_bulb', 'wind_direction', 'wind_speed', 'apparent_temp', 'humidity', 'air_pressure']
+
+# name: insert() arguments
+MODES = {
+    'single': dict(mode='single'),
+    'many': dict(mode='many'),
+    'upsert': dict(mode='upsert'),
+    'upsert_transaction': dict(mode='upsert', transaction=True),
+    'load': dict(mode='load'),
+}
+
+
+def make_rows(count, samples):
+    rows = []
+    for activity_id in range(1, count + 1):
+        row = {"activity_id": activity_id}
+        for column_index, column in enumerate(COLUMNS):
+            row[column] = ', '.join(str(round(10 + column_index + (second % 600) / 100, 1)) for second in range(samples))
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=3600, help='values per weather series')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--table', default='weather_insert_benchmark')
+    args = parser.parse_args(argv)
+
+    db = Connection(user=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'), host=os.getenv('DB_HOST'),
+                    port=int(os.getenv('DB_PORT', 3306)), charset="utf8mb4")
+    if db.cnx is None:
+        sys.exit("No MySQL connection, set DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and DB_NAME")
+
+    rows = make_rows(args.rows, args.samples)
+    megabytes = sum(len(value) for row in rows for value in row.values() if isinstance(value, str)) / 1024 / 1024
+    cursor = db.cnx.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {args.table}")
+    cursor.execute(f"CREATE TABLE {args.table} (activity_id BIGINT PRIMARY KEY, "
+                   f"{', '.join(f'{column} LONGTEXT' for column in COLUMNS)})")
+
+    results = []
+    try:
+        for name in args.modes:
+            cursor.execute(f"TRUNCATE TABLE {args.table}")
+            start = time.perf_counter()
+            if name == 'single':
+                ok = all(db.insert(table=args.table, json_data=row) for row in rows)
+            else:
+                ok = db.insert(table=args.table, json_data=rows, batch_size=args.batch_size, **MODES[name])
+            elapsed = time.perf_counter() - start
+            cursor.execute(f"SELECT COUNT(*) FROM {args.table}")
+            stored = cursor.fetchone()[0]
+            results.append({"mode": name, "ok": ok, "rows": stored, "seconds": round(elapsed, 3),
+                            "rows_per_second": round(len(rows) / elapsed, 1),
+                            "mb_per_second": round(megabytes / elapsed, 2)})
+
+        if 'upsert' in args.modes:
+            # Rerunning an upsert must not add rows
+            db.insert(table=args.table, json_data=rows, batch_size=args.batch_size, mode='upsert')
+            cursor.execute(f"SELECT COUNT(*) FROM {args.table}")
+            results.append({"mode": "upsert_rerun", "rows": cursor.fetchone()[0]})
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {args.table}")
+        db.close()
+
+    print(json.dumps({"rows": args.rows, "samples": args.samples, "megabytes": round(megabytes, 1),
+                      "batch_size": args.batch_size, "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
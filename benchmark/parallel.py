@@ -0,0 +1,99 @@
+"""
+Scaling benchmark of the process pool backfill.
+
+Runs the same chunk of synthetic activities through process_chunk with a
+growing number of worker processes and prints the throughput and speedup
+against the run without a pool as json. The Open-Meteo stub is served from a
+warmed cache, so the numbers show the blending that the pool spreads out:
+
+    python -m benchmark.parallel --activities 32 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark.fixtures import FIXTURES, make_activity  # noqa: E402
+from benchmark.pipeline import Unlimited  # noqa: E402
+from benchmark.stubs import OpenMeteoStub, StubConnection  # noqa: E402
+
+
+def run(handler, db, chunk, workers):
+    db.tables.pop(handler.weather_table, None)
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Start the workers before the clock so only the work is timed
+            list(executor.map(abs, range(workers)))
+            start = time.perf_counter()
+            failures = handler.process_chunk(db, chunk, executor)
+    else:
+        failures = handler.process_chunk(db, chunk)
+    elapsed = time.perf_counter() - start
+    return elapsed, failures, db.tables.get(handler.weather_table, [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixture', default='ride_4h', choices=list(FIXTURES))
+    parser.add_argument('--activities', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('WEATHER_TABLE', 'weather')
+    os.environ['METRICS'] = 'off'
+    cache_dir = tempfile.TemporaryDirectory()
+    os.environ['WEATHER_CACHE_PATH'] = os.path.join(cache_dir.name, 'open_meteo_cache.sqlite')
+
+    stub = OpenMeteoStub().start()
+    from supporting import open_meteo
+    open_meteo.FORECAST_URL = f'{stub.url}/v1/forecast'
+    open_meteo.ARCHIVE_URL = f'{stub.url}/v1/archive'
+    open_meteo.rate_limiter = Unlimited()
+    from src import main as handler
+    handler.setup_logging()
+    handler.log.setLevel("WARNING")
+
+    duration, speed = FIXTURES[args.fixture]
+    db = StubConnection()
+    for activity_id in range(1, args.activities + 1):
+        activity, activity_streams = make_activity(activity_id, duration, speed)
+        db.add('activity', activity)
+        db.add('activity_streams', activity_streams)
+    chunk = [(activity_id, activity_id) for activity_id in range(1, args.activities + 1)]
+
+    report = {"fixture": args.fixture, "activities": args.activities, "cpus": os.cpu_count(), "results": []}
+    try:
+        # Warm the weather cache so every run does the same work
+        run(handler, db, chunk, 1)
+        baseline = None
+        expected = None
+        for workers in args.workers:
+            elapsed, failures, rows = run(handler, db, chunk, workers)
+            if expected is None:
+                expected = rows
+            if baseline is None:
+                baseline = elapsed
+            report["results"].append({
+                "workers": workers,
+                "seconds": round(elapsed, 3),
+                "activities_per_second": round(args.activities / elapsed, 2),
+                "speedup": round(baseline / elapsed, 2),
+                "failures": len(failures),
+                "same_rows": rows == expected
+            })
+    finally:
+        stub.stop()
+        cache_dir.cleanup()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Offline benchmark of the weather enrichment pipeline.
+
+Runs every fixture through the same stages as lambda_handler against a local
+Open-Meteo stub and an in-memory database, and prints wall time and peak
+memory per stage as json:
+
+    python -m benchmark.pipeline --repeat 5 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark.fixtures import FIXTURES, make_activity  # noqa: E402
+from benchmark.stubs import OpenMeteoStub, StubConnection  # noqa: E402
+
+STAGES = ['db_read', 'parse', 'fetch', 'grid', 'interpolate', 'insert']
+
+
+def run_pipeline(main, db, activity_id, weather_table, measure):
+    """
+    Runs one activity through all stages, measure(stage, function) runs a stage.
+    """
+    activity = measure('db_read', lambda: db.get_specific(table='activity', where='id = %s',
+                                                          params=(activity_id,))[0])
+    activity_streams = measure('db_read', lambda: db.get_specific(table='activity_streams',
+                                                                  columns=main.STREAM_COLUMNS,
+                                                                  where='activity_id = %s', params=(activity_id,),
+                                                                  dictionary=True)[0])
+    # prepare_weather runs as in the handler, with each of its steps measured as a stage
+    steps = {'parse': (main, 'parse_streams'), 'fetch': (main, 'fetch_weather'),
+             'grid': (main.interpolation, 'build_hourly_grid')}
+    with contextlib.ExitStack() as stack:
+        for stage, (module, name) in steps.items():
+            stack.enter_context(mock.patch.object(module, name, measured(stage, getattr(module, name), measure)))
+        arguments = main.prepare_weather(activity, activity_streams)
+    datainput = measure('interpolate', lambda: main.blend_grid(*arguments))
+    measure('insert', lambda: db.insert(table=weather_table, json_data=datainput))
+    return len(arguments[4])
+
+
+def measured(stage, function, measure):
+    return lambda *args, **kwargs: measure(stage, lambda: function(*args, **kwargs))
+
+
+class Unlimited:
+    def acquire(self, tokens=1):
+        pass
+
+
+def timed(results):
+    def measure(stage, function):
+        start = time.perf_counter()
+        value = function()
+        results[stage] = results.get(stage, 0) + time.perf_counter() - start
+        return value
+    return measure
+
+
+def traced(results):
+    def measure(stage, function):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        value = function()
+        peak = tracemalloc.get_traced_memory()[1] - before
+        results[stage] = max(results.get(stage, 0), peak)
+        return value
+    return measure
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', nargs='*', default=list(FIXTURES), choices=list(FIXTURES))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per fixture, the median is reported')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of delay added by the Open-Meteo stub')
+    parser.add_argument('--cache', action='store_true', help='keep the Open-Meteo cache enabled')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Open-Meteo calls per second allowed by the rate limiter, 0 disables it')
+    parser.add_argument('--output', help='write the json report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if not args.cache:
+        os.environ['WEATHER_CACHE'] = 'off'
+    weather_table = os.getenv('WEATHER_TABLE', 'weather')
+
+    stub = OpenMeteoStub(latency=args.latency).start()
+    from supporting import open_meteo
+    open_meteo.FORECAST_URL = f'{stub.url}/v1/forecast'
+    open_meteo.ARCHIVE_URL = f'{stub.url}/v1/archive'
+    if args.rate > 0:
+        open_meteo.rate_limiter = open_meteo.TokenBucket(rate=args.rate, capacity=args.rate)
+    else:
+        open_meteo.rate_limiter = Unlimited()
+    from src import main as handler
+    handler.setup_logging()
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "repeat": args.repeat, "results": []}
+    try:
+        for activity_id, name in enumerate(args.fixtures, start=1):
+            duration, speed = FIXTURES[name]
+            db = StubConnection()
+            activity, activity_streams = make_activity(activity_id, duration, speed)
+            db.add('activity', activity)
+            db.add('activity_streams', activity_streams)
+
+            timings = {stage: [] for stage in STAGES}
+            calls = stub.calls
+            for _ in range(args.repeat):
+                results = {}
+                samples = run_pipeline(handler, db, activity_id, weather_table, timed(results))
+                for stage in STAGES:
+                    timings[stage].append(results.get(stage, 0))
+            calls = (stub.calls - calls) / args.repeat
+
+            peaks = {}
+            tracemalloc.start()
+            try:
+                run_pipeline(handler, db, activity_id, weather_table, traced(peaks))
+            finally:
+                tracemalloc.stop()
+
+            stages = {stage: {"wall_s": round(statistics.median(timings[stage]), 6),
+                              "peak_kb": round(peaks.get(stage, 0) / 1024, 1)} for stage in STAGES}
+            report["results"].append({
+                "fixture": name,
+                "samples": samples,
+                "http_calls": calls,
+                "inserted_bytes": db.inserted_bytes // (args.repeat + 1),
+                "total_s": round(sum(stage["wall_s"] for stage in stages.values()), 6),
+                "stages": stages
+            })
+    finally:
+        stub.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class OpenMeteoStub:
+    """
+    Local stand-in for the Open-Meteo forecast and archive endpoints.
+
+    Responses are generated once per (grid cell, date) and replayed afterwards,
+    so every run serves the same data. Coordinates are snapped to a 0.1 degree
+    grid like the real API does. latency adds a delay to every request, a
+    status of 400 or more answers every request with an Open-Meteo error body.
+    """
+
+    def __init__(self, latency=0.0, status=200):
+        self.latency = latency
+        self.status = status
+        self.calls = 0
+        # Requests in progress, the most seen at once and when each one arrived
+        self.active = 0
+        self.max_active = 0
+        self.arrivals = []
+        self.responses = {}
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                body = json.dumps(stub.respond(query)).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def day(self, latitude, longitude, day):
+        key = (latitude, longitude, day)
+        with self.lock:
+            if key not in self.responses:
+                start = datetime.strptime(day, '%Y-%m-%d')
+                hourly = {"time": [], "temperature_2m": [], "apparent_temperature": [], "relative_humidity_2m": [],
+                          "weather_code": [], "wind_speed_10m": [], "wind_direction_10m": [], "dew_point_2m": [],
+                          "surface_pressure": []}
+                for hour in range(24):
+                    phase = math.sin((hour - 6) / 24 * 2 * math.pi) + (latitude % 1 - longitude % 1) / 4
+                    hourly["time"].append((start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M'))
+                    hourly["temperature_2m"].append(round(18 + 6 * phase, 1))
+                    hourly["apparent_temperature"].append(round(17 + 7 * phase, 1))
+                    hourly["relative_humidity_2m"].append(round(70 - 15 * phase))
+                    hourly["weather_code"].append(hour % 4)
+                    hourly["wind_speed_10m"].append(round(15 + 5 * phase, 1))
+                    hourly["wind_direction_10m"].append(round((200 + 40 * phase) % 360))
+                    hourly["dew_point_2m"].append(round(12 + 2 * phase, 1))
+                    hourly["surface_pressure"].append(round(1013 + 4 * phase, 1))
+                self.responses[key] = hourly
+            return self.responses[key]
+
+    def respond(self, query):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.arrivals.append(time.monotonic())
+        try:
+            if self.latency > 0:
+                threading.Event().wait(self.latency)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.calls += 1
+        if self.status >= 400:
+            return {"error": True, "reason": f"Stub answered {self.status}"}
+        start_date = datetime.strptime(query['start_date'][0], '%Y-%m-%d')
+        end_date = datetime.strptime(query['end_date'][0], '%Y-%m-%d')
+        days = [str((start_date + timedelta(days=i)).date()) for i in range((end_date - start_date).days + 1)]
+        results = []
+        for lat, lon in zip(query['latitude'][0].split(','), query['longitude'][0].split(',')):
+            latitude = round(round(float(lat) * 10) / 10 + 0.0125, 4)
+            longitude = round(round(float(lon) * 10) / 10 + 0.0375, 4)
+            hourly = {}
+            for day in days:
+                for key, values in self.day(latitude, longitude, day).items():
+                    hourly.setdefault(key, []).extend(values)
+            results.append({"latitude": latitude, "longitude": longitude, "hourly": hourly})
+        if len(results) == 1:
+            return results[0]
+        return results
+
+
+class StubConnection:
+    """
+    In-memory stand-in for database.db.Connection with the calls the handlers use.
+
+    Rows are stored as tuples in the column order of the real tables, COLUMNS
+    maps the column names the handlers select to their position.
+    """
+
+    COLUMNS = {
+        'activity': {'id': 0, 'start_date': 9},
+        'activity_streams': {'id': 0, 'activity_id': 1, 'time': 2, 'latlng': 5},
+    }
+
+    def __init__(self):
+        self.tables = {}
+        self.inserted_bytes = 0
+
+    def add(self, table, row):
+        self.tables.setdefault(table, []).append(row)
+
+    def get_specific(self, table="", where="1=1", order_by="id", order_by_type="asc", custom="", columns=None,
+                     params=None, dictionary=False, prepared=False):
+        if params is not None:
+            ids = {int(value) for value in params}
+        else:
+            ids = {int(value) for value in re.findall(r'\d+', where)}
+        column = 1 if table == 'activity_streams' else 0
+        rows = [row for row in self.tables.get(table, []) if row[column] in ids]
+        if columns is not None:
+            positions = [self.COLUMNS[table][name] for name in columns]
+            rows = [tuple(row[position] for position in positions) for row in rows]
+        if dictionary:
+            return [dict(zip(columns, row)) for row in rows]
+        return rows
+
+    def insert(self, table, json_data, batch_size=1000, mode='single', unique_column='activity_id',
+               transaction=False):
+        rows = json_data if isinstance(json_data, list) else [json_data]
+        for row in rows:
+            self.add(table, row)
+            self.inserted_bytes += sum(len(value) for value in row.values() if isinstance(value, (str, bytes)))
+        return True
+
+    def close(self):
+        pass
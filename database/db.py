@@ -1,14 +1,20 @@
-import mysql.connector
 import datetime
 import logging
 import os
+import tempfile
+import threading
+import time
 
 # from dotenv import load_dotenv
 # load_dotenv()
 
-formatter = logging.Formatter('[%(levelname)s] %(message)s')
 log = logging.getLogger()
-log.setLevel("INFO")
+
+def connector():
+    # mysql.connector is imported on first use to keep cold starts short
+    import mysql.connector
+    return mysql.connector
+
 
 def convert_to_date_string(data):
     if isinstance(data, datetime.date):  # Check if it's a datetime.date object
@@ -17,52 +23,120 @@ def convert_to_date_string(data):
         return data  #
 
 
+def infile_value(value):
+    """
+    Formats a value for a LOAD DATA file with the default escaping.
+    """
+    if value is None:
+        return b'\\N'
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    elif not isinstance(value, (bytes, bytearray)):
+        value = str(value).encode('utf8')
+    return bytes(value).replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(b'\n', b'\\n') \
+        .replace(b'\r', b'\\r').replace(b'\0', b'\\0')
+
+
+# Modes of Connection.insert
+INSERT_MODES = ('single', 'many', 'upsert', 'load')
+
+# Prepared statements kept open per connection, the oldest is closed beyond this
+PREPARED_STATEMENTS = int(os.getenv('DB_PREPARED_STATEMENTS', 16))
+
+# Rows per fetchmany call when streaming a result
+FETCH_SIZE = int(os.getenv('DB_FETCH_SIZE', 1000))
+
+# Aggregate that picks the key of the row remove_duplicates keeps
+KEEP = {'newest': 'MAX', 'oldest': 'MIN'}
+
+
+def select_list(columns):
+    if columns is None:
+        return '*'
+    return ', '.join(columns)
+
+
+def fetch_rows(cursor, dictionary=False):
+    data = cursor.fetchall()
+    if dictionary:
+        return [dict(zip(cursor.column_names, row)) for row in data]
+    return data
+
 
 class Connection:
     def __init__(self, user, password, host, port, charset):
+        # Prepared cursors keyed by query string, see prepared_cursor
+        self.prepared = {}
         try:
-            self.cnx = mysql.connector.connect(
+            self.cnx = connector().connect(
                 user=user,
                 password=password,
                 host=host,
                 database=os.getenv('DB_NAME'),
                 port=port,
-                charset=charset
+                charset=charset,
+                # Needed for insert(mode='load'), the server must allow it as well
+                allow_local_infile=os.getenv('DB_LOCAL_INFILE', 'off') == 'on'
             )
-        except mysql.connector.Error as err:
+        except connector().Error as err:
             log.error("Connection to MySQL db could not be established")
             log.error(err)
             self.cnx = None
 
-    def insert(self, table, json_data, batch_size=1000, mode='single'):
+    def insert(self, table, json_data, batch_size=1000, mode='single', unique_column='activity_id', transaction=False):
+        """
+        Inserts one record or a list of records.
+
+        mode='single' inserts the records one statement at a time.
+        mode='many' inserts the records with executemany, batch_size at a time.
+        mode='upsert' writes multi-row INSERT ... ON DUPLICATE KEY UPDATE
+        statements of batch_size rows, so rerunning a record replaces it instead
+        of adding a duplicate. This needs a unique key on unique_column.
+        mode='load' writes the records to a temporary file and sends it with
+        LOAD DATA LOCAL INFILE ... REPLACE, the fastest path for very large
+        backfills. It needs DB_LOCAL_INFILE=on and local_infile on the server.
+
+        With transaction=True all batches are committed at once at the end,
+        otherwise every batch is committed on its own.
+
+        Returns:
+        True when the records were inserted.
+
+        Raises:
+        ValueError for a mode that is not one of INSERT_MODES.
+        """
+        if mode not in INSERT_MODES:
+            raise ValueError(f"Unknown insert mode {mode!r}, expected one of {', '.join(INSERT_MODES)}")
         log.info(f"Trying to insert records into table {table}")
         cursor = self.cnx.cursor()  # Get cursor from existing connection
         if table == 'activity':
             cursor.execute("SET NAMES utf8mb4;")
         if mode == 'single':
             try:
+                records = json_data if isinstance(json_data, list) else [json_data]
+                for data in records:
+                    # Extract column names and values from the JSON data
+                    columns = ', '.join(data.keys())
+                    values = ', '.join(['%s'] * len(data))
 
-                # Construct the SQL query for bulk insert
-
-
-                # Extract column names and values from the JSON data
-                columns = ', '.join(json_data.keys())
-                values = ', '.join(['%s'] * len(json_data))
+                    # Construct the SQL INSERT query
+                    query = f"INSERT INTO {table} ({columns}) VALUES ({values})"
 
-                # Construct the SQL INSERT query
-                query = f"INSERT INTO {table} ({columns}) VALUES ({values})"
+                    # Execute the query with the JSON values
+                    cursor.execute(query, tuple(data.values()))
 
-                # Execute the query with the JSON values
-                cursor.execute(query, tuple(json_data.values()))
+                    if not transaction:
+                        self.cnx.commit()
 
                 # Commit the changes to the database
                 self.cnx.commit()
 
                 log.info("Data inserted successfully")
 
-            except mysql.connector.Error as err:
+            except connector().Error as err:
                 log.error(f"Error: {err}")
                 self.cnx.rollback()  # Rollback changes in case of an error
+                return False
 
         if mode == 'many':
             if len(json_data) > 0:
@@ -83,36 +157,145 @@ class Connection:
                         cursor.executemany(query, data_tuples)
 
                         # Commit the changes for the batch
-                        self.cnx.commit()
+                        if not transaction:
+                            self.cnx.commit()
 
                         log.info(f"Successfully inserted {len(batch_data)} rows (batch {i // batch_size + 1}) into the table {table}.")
 
-                except mysql.connector.Error as err:
+                    self.cnx.commit()
+
+                except connector().Error as err:
+                    log.error(f"Error: {err}")
+                    self.cnx.rollback()  # Rollback changes in case of an error
+                    return False
+
+        if mode == 'upsert':
+            records = json_data if isinstance(json_data, list) else [json_data]
+            if len(records) > 0:
+                try:
+                    columns = list(records[0].keys())
+                    updates = ', '.join([f"{col} = VALUES({col})" for col in columns if col != unique_column])
+                    row = f"({', '.join(['%s'] * len(columns))})"
+
+                    for i in range(0, len(records), batch_size):
+                        batch_data = records[i:i + batch_size]
+
+                        # One statement with a VALUES group per record
+                        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * len(batch_data))} " \
+                                f"ON DUPLICATE KEY UPDATE {updates}"
+                        cursor.execute(query, tuple(data[col] for data in batch_data for col in columns))
+
+                        if not transaction:
+                            self.cnx.commit()
+
+                        log.info(f"Successfully upserted {len(batch_data)} rows (batch {i // batch_size + 1}) into the table {table}.")
+
+                    self.cnx.commit()
+
+                except connector().Error as err:
+                    log.error(f"Error: {err}")
+                    self.cnx.rollback()  # Rollback changes in case of an error
+                    return False
+
+        if mode == 'load':
+            records = json_data if isinstance(json_data, list) else [json_data]
+            if len(records) > 0:
+                columns = list(records[0].keys())
+                file = tempfile.NamedTemporaryFile('wb', suffix='.tsv', delete=False)
+                try:
+                    with file:
+                        for data in records:
+                            file.write(b'\t'.join(infile_value(data[col]) for col in columns) + b'\n')
+
+                    # The defaults of LOAD DATA match infile_value: tab separated, backslash escaped
+                    query = f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {table} CHARACTER SET utf8mb4 " \
+                            f"({', '.join(columns)})"
+                    cursor.execute(query, (file.name,))
+                    self.cnx.commit()
+
+                    log.info(f"Successfully loaded {len(records)} rows into the table {table}.")
+
+                except connector().Error as err:
                     log.error(f"Error: {err}")
                     self.cnx.rollback()  # Rollback changes in case of an error
+                    return False
+                finally:
+                    os.remove(file.name)
+        return True
 
-    def get_all(self, table, order_by='id', order_by_type='asc', type='first'):
+    def get_all(self, table, order_by='id', order_by_type='asc', type='first', columns=None, dictionary=False):
         try:
-            results = {}
             cursor = self.cnx.cursor()  # Get cursor from existing connection
-            if type == 'all':
-                query = f"SELECT * FROM {table} ORDER BY {order_by} {order_by_type}"
-            elif type == 'first':
-                query = f"SELECT * FROM {table} ORDER BY {order_by} {order_by_type}"
+            query = f"SELECT {select_list(columns)} FROM {table} ORDER BY {order_by} {order_by_type}"
+            if type == 'first':
+                # Let the server pick the first row instead of sending the whole table
+                cursor.execute(f"{query} LIMIT 1")
+                data = fetch_rows(cursor, dictionary)
+                return data[0] if data else None
+            elif type == 'all':
+                cursor.execute(query)
+                return fetch_rows(cursor, dictionary)
             else:
                 return []
-            cursor.execute(query)
-            data = cursor.fetchall()
-
-            if type == 'all':
-                return data
-            elif type == 'first':
-                return data[0]
 
-
-        except mysql.connector.Error as err:
+        except connector().Error as err:
             log.error(f"Error: {err}")
 
+    def iter_all(self, table, order_by='id', order_by_type='asc', columns=None, dictionary=False, size=None):
+        """
+        Like get_all(type='all') but yields the rows one by one in constant memory.
+        """
+        query = f"SELECT {select_list(columns)} FROM {table} ORDER BY {order_by} {order_by_type}"
+        return self.iter_rows(query, dictionary=dictionary, size=size)
+
+    def iter_specific(self, table="", where="1=1", order_by="id", order_by_type="asc", custom="", columns=None,
+                      params=None, dictionary=False, size=None):
+        """
+        Like get_specific but yields the rows one by one in constant memory.
+        """
+        if custom != "":
+            query = custom
+        else:
+            query = f"SELECT {select_list(columns)} FROM {table} WHERE {where} ORDER BY {order_by} {order_by_type}"
+        return self.iter_rows(query, params=params, dictionary=dictionary, size=size)
+
+    def iter_rows(self, query, params=None, dictionary=False, size=None):
+        """
+        Runs query on an unbuffered cursor and yields the rows in fetchmany chunks.
+
+        The server streams the result, so only one chunk is held in memory. The
+        connection can not run other queries until the generator is exhausted
+        or closed; closing it early reads and drops the remaining rows.
+
+        Args:
+        query: The select query.
+        params: Values for the %s placeholders in query.
+        dictionary: Yield every row as a dict keyed by column name.
+        size: Rows per fetchmany call, DB_FETCH_SIZE (default 1000) when None.
+        """
+        size = size or FETCH_SIZE
+        cursor = self.cnx.cursor(buffered=False)
+        try:
+            if params is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, tuple(params))
+            while True:
+                data = cursor.fetchmany(size)
+                if not data:
+                    break
+                if dictionary:
+                    for row in data:
+                        yield dict(zip(cursor.column_names, row))
+                else:
+                    yield from data
+        except connector().Error as err:
+            log.error(f"Error: {err}")
+            raise
+        finally:
+            if self.cnx.unread_result:
+                self.cnx.consume_results()
+            cursor.close()
 
     def update(self, table='', json_data=None, record_id='id', mode='single', unique_column='id', custom=''):
         cursor = self.cnx.cursor()  # Get cursor from existing connection
@@ -139,38 +322,234 @@ class Connection:
 
                 log.info("Record updated successfully!")
 
-            except mysql.connector.Error as err:
+            except connector().Error as err:
                 log.error(f"Error updating record: {err}")
 
 
-    def remove_duplicates(self, table, grouping):
+    def remove_duplicates(self, table, grouping, keep='newest', key='id', chunk_size=1000, dry_run=False):
+        """
+        Deletes duplicate rows on the server, one row per grouping value is kept.
+
+        The rows to delete are selected with a join against the kept key per
+        group and deleted by key in chunks of chunk_size, every chunk is
+        committed on its own so no long locks are held on a large table.
+
+        Args:
+        table: Table to deduplicate.
+        grouping: Comma separated columns that identify a duplicate, e.g. "activity_id".
+        keep: 'newest' keeps the row with the highest key, 'oldest' the lowest.
+        key: Unique (auto increment) column that orders the rows.
+        chunk_size: Maximum number of rows deleted per statement.
+        dry_run: Only count, nothing is deleted.
+
+        Returns:
+        Dict with the rows examined, the duplicate groups, the duplicate rows
+        and the rows removed, or None on a database error.
+        """
+        if keep not in KEEP:
+            raise ValueError(f"keep must be one of {', '.join(KEEP)}")
+        columns = [column.strip() for column in grouping.split(',')]
+        group_by = ', '.join(columns)
+        duplicates = (f"SELECT {group_by}, {KEEP[keep]}({key}) AS keep_key FROM {table} "
+                      f"GROUP BY {group_by} HAVING COUNT(*) > 1")
+        join = ' AND '.join(f"t.{column} <=> d.{column}" for column in columns)
+        summary = {"examined": 0, "groups": 0, "duplicates": 0, "removed": 0, "dry_run": dry_run}
         try:
-            results = {}
-            cursor = self.cnx.cursor()  # Get cursor from existing connection
-            query = f"SELECT * FROM {table} GROUP BY {grouping} HAVING count(*) > 1"
-            cursor.execute(query)
-            data = cursor.fetchall()
-
-            for item in data:
-                activity_id = item[0]
-                log.info(activity_id)
-
+            cursor = self.cnx.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            summary["examined"] = cursor.fetchone()[0]
+            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(rows_in_group), 0) - COUNT(*) FROM "
+                           f"(SELECT COUNT(*) AS rows_in_group FROM {table} GROUP BY {group_by} "
+                           f"HAVING COUNT(*) > 1) AS groups_with_duplicates")
+            groups, duplicate_rows = cursor.fetchone()
+            summary["groups"] = int(groups)
+            summary["duplicates"] = int(duplicate_rows)
+
+            while not dry_run:
+                cursor.execute(f"SELECT t.{key} FROM {table} AS t JOIN ({duplicates}) AS d ON {join} "
+                               f"WHERE t.{key} <> d.keep_key LIMIT %s", (chunk_size,))
+                keys = [row[0] for row in cursor.fetchall()]
+                if not keys:
+                    break
+                cursor.execute(f"DELETE FROM {table} WHERE {key} IN ({', '.join(['%s'] * len(keys))})", keys)
+                self.cnx.commit()
+                summary["removed"] += cursor.rowcount
+                log.info(f"Removed {summary['removed']} of {summary['duplicates']} duplicate rows from {table}")
+            cursor.close()
+            return summary
 
-        except mysql.connector.Error as err:
+        except connector().Error as err:
             log.error(f"Error: {err}")
-    def get_specific(self, table="", where="1=1", order_by="id", order_by_type="asc", custom=""):
+            self.cnx.rollback()
+            return None
+
+    def get_specific(self, table="", where="1=1", order_by="id", order_by_type="asc", custom="", columns=None,
+                     params=None, dictionary=False, prepared=False):
+        """
+        Selects rows from table.
+
+        Args:
+        columns: Columns to select, all columns when None.
+        params: Values for the %s placeholders in where (or custom). They are
+            sent separately from the query instead of being formatted into it.
+        dictionary: Return every row as a dict keyed by column name.
+        prepared: Use a server side prepared statement, so repeated queries
+            with different params reuse the same plan. The statement stays
+            prepared on the connection, see prepared_cursor.
+        """
         try:
             if custom != "":
                 query = custom
             else:
-                query = f"SELECT * FROM {table} WHERE {where} ORDER BY {order_by} {order_by_type}"
+                query = f"SELECT {select_list(columns)} FROM {table} WHERE {where} ORDER BY {order_by} {order_by_type}"
 
-            cursor = self.cnx.cursor()  # Get cursor from existing connection
+            if prepared:
+                cursor, query = self.prepared_cursor(query)
+            else:
+                cursor = self.cnx.cursor()
             # log.info(query)
-            cursor.execute(query)
-            data = cursor.fetchall()
+            if params is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, tuple(params))
+            data = fetch_rows(cursor, dictionary)
             return data
         except Exception as e:
+            if prepared:
+                self.close_prepared(query)
             return e
+
+    def prepared_cursor(self, query):
+        """
+        Returns (cursor, query) with the prepared cursor of a query string.
+
+        The statement is prepared once per connection and reused by later
+        calls. mysql-connector only reuses it when execute gets the same
+        string object it was prepared with, so that object is returned as well.
+        At most PREPARED_STATEMENTS are kept, the oldest is closed first.
+        """
+        cached = self.prepared.get(query)
+        if cached is None:
+            if len(self.prepared) >= PREPARED_STATEMENTS:
+                self.close_prepared(next(iter(self.prepared)))
+            cached = (self.cnx.cursor(prepared=True), query)
+            self.prepared[query] = cached
+        return cached
+
+    def close_prepared(self, query=None):
+        """
+        Closes the prepared cursor of a query, or all of them when query is None.
+        """
+        queries = list(self.prepared) if query is None else [query]
+        for query in queries:
+            cached = self.prepared.pop(query, None)
+            if cached is None:
+                continue
+            try:
+                cached[0].close()
+            except Exception as err:
+                log.warning(f"Closing prepared statement failed: {err}")
+
+    def ping(self):
+        # Checks the connection and reconnects once when the server went away
+        try:
+            connection_id = self.cnx.connection_id
+            self.cnx.ping(reconnect=True, attempts=1, delay=0)
+            if self.cnx.connection_id != connection_id:
+                # Prepared statements do not survive a reconnect
+                self.prepared = {}
+            return True
+        except (connector().Error, AttributeError) as err:
+            log.warning(f"Connection check failed: {err}")
+            return False
+
+    def rollback(self):
+        # Ends the open transaction, so the next user does not read through its old snapshot
+        try:
+            self.cnx.rollback()
+            return True
+        except (connector().Error, AttributeError) as err:
+            log.warning(f"Rollback failed: {err}")
+            return False
+
     def close(self):  # Method to close connection when done
+        self.close_prepared()
         self.cnx.close()
+
+
+class ConnectionPool:
+    """
+    Keeps a few Connection objects alive between warm Lambda invocations.
+
+    Connections are checked with a ping before they are handed out, and
+    replaced when they have been idle for longer than max_idle seconds, which
+    stays below the server wait_timeout so we rarely hit a dead socket.
+    Released connections are rolled back first: without autocommit a read
+    keeps its REPEATABLE READ snapshot open, and the next invocation would not
+    see rows written since.
+    """
+
+    def __init__(self, user, password, host, port, charset, size=None, max_idle=None):
+        self.settings = dict(user=user, password=password, host=host, port=port, charset=charset)
+        self.size = size if size is not None else int(os.getenv('DB_POOL_SIZE', 2))
+        self.max_idle = max_idle if max_idle is not None else int(os.getenv('DB_POOL_MAX_IDLE', 300))
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if len(self.idle) == 0:
+                    break
+                db, last_used = self.idle.pop()
+            if time.time() - last_used > self.max_idle:
+                log.info("Recycling idle database connection")
+                self.discard(db)
+                continue
+            if db.ping():
+                return db
+            self.discard(db)
+        return Connection(**self.settings)
+
+    def release(self, db):
+        if db is None or db.cnx is None:
+            return
+        if not db.rollback():
+            self.discard(db)
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((db, time.time()))
+                return
+        self.discard(db)
+
+    def discard(self, db):
+        try:
+            db.close()
+        except Exception as err:
+            log.warning(f"Closing connection failed: {err}")
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for db, last_used in idle:
+            self.discard(db)
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(user, password, host, port, charset, size=None, max_idle=None):
+    """
+    Returns the module level pool for these settings, creating it on first use.
+    """
+    key = (user, host, port, charset)
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None or pool.settings['password'] != password:
+            if pool is not None:
+                pool.close()
+            pool = ConnectionPool(user, password, host, port, charset, size=size, max_idle=max_idle)
+            pools[key] = pool
+    return pool
@@ -0,0 +1,116 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+# Binary rows start with MAGIC, a format version byte, a flags byte and the
+# number of samples, followed by the values as little endian int16 x SCALE.
+# Version 2 rows are sparse: after the header comes the number of stored
+# values, the sample indices as uint32 deltas and then the values. With
+# FLAG_LINEAR the samples in between are linearly interpolated, otherwise a
+# value holds until the next stored one.
+MAGIC = b'WX'
+FORMAT_VERSION = 1
+SPARSE_FORMAT_VERSION = 2
+HEADER = struct.Struct('<2sBBI')
+SPARSE_HEADER = struct.Struct('<I')
+FLAG_ZLIB = 1
+FLAG_LINEAR = 4
+SCALE = 10
+
+
+def to_fixed_point(values):
+    scaled = np.round(np.asarray(values, dtype=np.float64) * SCALE)
+    if len(scaled) > 0 and (scaled.min() < np.iinfo(np.int16).min or scaled.max() > np.iinfo(np.int16).max):
+        raise ValueError("Weather series does not fit in int16 fixed-point")
+    return scaled.astype('<i2')
+
+
+def encode_series(values, compress=True, indices=None, count=None, linear=False):
+    """
+    Packs a weather series as fixed-point int16 (one decimal), optionally zlib compressed.
+
+    Args:
+    values: Sequence of floats.
+    compress: Compress the packed values with zlib.
+    indices: Sample indices of the values for a sparse series, None for a
+        value per sample.
+    count: Number of samples of a sparse series.
+    linear: Reconstruct a sparse series by linear interpolation instead of
+        holding every value until the next one.
+
+    Returns:
+    Bytes for a BLOB column.
+    """
+    scaled = to_fixed_point(values)
+    flags = 0
+    if indices is None:
+        version = FORMAT_VERSION
+        count = len(scaled)
+        payload = scaled.tobytes()
+    else:
+        version = SPARSE_FORMAT_VERSION
+        deltas = np.diff(np.asarray(indices, dtype=np.int64), prepend=0).astype('<u4')
+        payload = SPARSE_HEADER.pack(len(scaled)) + deltas.tobytes() + scaled.tobytes()
+        if linear:
+            flags |= FLAG_LINEAR
+    if compress:
+        payload = zlib.compress(payload)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, version, flags, count) + payload
+
+
+def is_binary(data):
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:2]) == MAGIC
+
+
+def decode_series(data, offsets=None):
+    """
+    Reads a stored weather series: a binary row, sparse or not, or an old ', ' joined text row.
+
+    Args:
+    data: The stored column value.
+    offsets: Time offsets of the samples, used to linearly interpolate sparse
+        rows. Without them the samples are treated as evenly spaced.
+
+    Returns:
+    Float64 numpy array with one value per sample.
+    """
+    if data is None:
+        return np.empty(0, dtype=np.float64)
+    if is_binary(data):
+        data = bytes(data)
+        magic, version, flags, count = HEADER.unpack_from(data)
+        if version not in (FORMAT_VERSION, SPARSE_FORMAT_VERSION):
+            raise ValueError(f"Unknown weather series format version {version}")
+        payload = data[HEADER.size:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        if version == FORMAT_VERSION:
+            values = np.frombuffer(payload, dtype='<i2', count=count)
+            return values.astype(np.float64) / SCALE
+
+        stored = SPARSE_HEADER.unpack_from(payload)[0]
+        start = SPARSE_HEADER.size
+        indices = np.cumsum(np.frombuffer(payload, dtype='<u4', count=stored, offset=start), dtype=np.int64)
+        values = np.frombuffer(payload, dtype='<i2', count=stored, offset=start + 4 * stored).astype(np.float64) / SCALE
+        return expand_series(indices, values, count, offsets=offsets, linear=bool(flags & FLAG_LINEAR))
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode()
+    if data.strip() == '':
+        return np.empty(0, dtype=np.float64)
+    return np.fromstring(data, dtype=np.float64, sep=',')
+
+
+def expand_series(indices, values, count, offsets=None, linear=False):
+    """
+    Expands values stored at some sample indices back to one value per sample.
+    """
+    if len(indices) == 0:
+        return np.full(count, np.nan)
+    samples = np.arange(count)
+    if linear:
+        x = samples if offsets is None else np.asarray(offsets, dtype=np.float64)[:count]
+        return np.interp(x, x[indices], values)
+    return values[np.maximum(np.searchsorted(indices, samples, side='right') - 1, 0)]
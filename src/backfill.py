@@ -0,0 +1,31 @@
+"""
+Command line driver for the weather backfill:
+
+    python src/backfill.py --chunk-size 500 --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import backfill  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculate the weather for every activity that has none yet.")
+    parser.add_argument('--chunk-size', type=int, help='activities per chunk (BACKFILL_CHUNK_SIZE)')
+    parser.add_argument('--state-table', help='DynamoDB table with the high-water mark (BACKFILL_TABLE)')
+    parser.add_argument('--state-id', help='item id of the high-water mark (BACKFILL_ID)')
+    parser.add_argument('--workers', type=int, help='worker processes for the blending (BACKFILL_WORKERS)')
+    parser.add_argument('--restart', action='store_true', help='ignore the high-water mark and start over')
+    args = parser.parse_args(argv)
+
+    summary = backfill(chunk_size=args.chunk_size, state_table=args.state_table, state_id=args.state_id,
+                       restart=args.restart, workers=args.workers)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
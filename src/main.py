@@ -1,11 +1,22 @@
 import logging
 import os
-from datetime import datetime, timedelta
-from database.db import Connection
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from database.db import get_pool
+from database import encoding
 import uuid
 from supporting import aws
 import math
-from supporting.open_meteo import Weather
+from supporting.open_meteo import WeatherBatch
+from supporting import interpolation
+from supporting import streams
+from supporting import sampling
+from supporting import metrics
+from supporting import resolution
+from supporting import derived
+from supporting import profiling
 
 
 class CorrelationIdFilter(logging.Filter):
@@ -14,34 +25,65 @@ class CorrelationIdFilter(logging.Filter):
         # Generate a new correlation ID
         self.correlation_id = str(uuid.uuid4())
 
+    def refresh(self, context=None):
+        # Every invocation gets its own ID, the Lambda request id when there is one
+        self.correlation_id = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+        return self.correlation_id
+
     def filter(self, record):
         # Add correlation ID to the log record
         record.correlation_id = self.correlation_id
         return True
 
 
-# Logging formatter that includes the correlation ID
-formatter = logging.Formatter('[%(levelname)s] [%(asctime)s] [Correlation ID: %(correlation_id)s] %(message)s')
-
-# Set up the root logger
 log = logging.getLogger()
-log.setLevel("INFO")
-logging.getLogger("boto3").setLevel(logging.WARNING)
-logging.getLogger("botocore").setLevel(logging.WARNING)
+correlation_filter = CorrelationIdFilter()
+logging_ready = False
 
-# Remove existing handlers
-for handler in log.handlers:
-    log.removeHandler(handler)
 
-# Add a new handler with the custom formatter
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
-log.addHandler(handler)
+def setup_logging():
+    """
+    Configures the root logger on the first invocation instead of at import time.
+    """
+    global logging_ready
+    if logging_ready:
+        return
+    logging_ready = True
+
+    # Logging formatter that includes the correlation ID
+    formatter = logging.Formatter('[%(levelname)s] [%(asctime)s] [Correlation ID: %(correlation_id)s] %(message)s')
+
+    # Set up the root logger
+    log.setLevel("INFO")
+    logging.getLogger("boto3").setLevel(logging.WARNING)
+    logging.getLogger("botocore").setLevel(logging.WARNING)
+
+    # Remove existing handlers
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+
+    # Add a new handler with the custom formatter
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    log.addHandler(handler)
+
+    # Add the CorrelationIdFilter to the logger
+    log.addFilter(correlation_filter)
+
 
-# Add the CorrelationIdFilter to the logger
-correlation_filter = CorrelationIdFilter()
-log.addFilter(correlation_filter)
 weather_table = os.getenv('WEATHER_TABLE')
+# 'text' stores ', ' joined values, 'binary' stores encoding.encode_series blobs
+weather_format = os.getenv('WEATHER_FORMAT', 'text')
+# 'full' stores every sample, 'changes' only the samples where the value changes
+# and a number of seconds one sample per interval. Reduced rows are always binary.
+weather_resolution = os.getenv('WEATHER_RESOLUTION', 'full')
+# The only activity_streams columns the weather needs, the others hold large unused streams
+STREAM_COLUMNS = ['activity_id', 'time', 'latlng']
+# 'upsert' (multi-row INSERT ... ON DUPLICATE KEY UPDATE) or 'load' (LOAD DATA LOCAL INFILE) for big backfills
+weather_insert_mode = os.getenv('WEATHER_INSERT_MODE', 'upsert')
+# Also store the derived.DERIVED series (dew point, heat index, headwind, crosswind),
+# WEATHER_TABLE needs a column for each of them
+weather_derived = os.getenv('WEATHER_DERIVED', 'off') == 'on'
 
 
 def calculate_wet_bulb(realtemp, rh):
@@ -85,210 +127,447 @@ def haversine_afstand(lat1, lon1, lat2, lon2):
     return afstand
 
 
-def lambda_handler(event, context):
-    activity_id = event.get("activity_id")
-    log.info(f"Start handling laps for activity {activity_id}")
+def database_pool():
     database_id = os.getenv('DATABASE_ID')
-    database_settings = aws.dynamodb_query(table='database_settings', id=database_id)
+    with metrics.timer('settings_lookup'):
+        database_settings = aws.dynamodb_query(table='database_settings', id=database_id)
     db_host = database_settings[0]['host']
     db_user = database_settings[0]['user']
     db_password = database_settings[0]['password']
     db_port = database_settings[0]['port']
-    db = Connection(user=db_user, password=db_password, host=db_host, port=db_port, charset="utf8mb4")
-
-    all_activities = db.get_specific(table='activity', where=f'id = {activity_id}', order_by_type='desc')
-    act_counter = 0
-    total_act = len(all_activities)
-    for activity in all_activities:
-        act_counter += 1
-        activity_id = activity[0]
-        start_date_time = activity[9]
-        log.info(f'Handling activity {activity_id} ({act_counter}/{total_act})')
-
-        activity_streams = db.get_specific(table='activity_streams', where=f'activity_id={activity_id}')[0]
-        if activity_streams is None:
-            continue
-        if activity_streams[2] is None:
+    return get_pool(user=db_user, password=db_password, host=db_host, port=db_port, charset="utf8mb4")
+
+
+def parse_streams(activity_streams):
+    """
+    Returns (lats, lons, offsets) arrays, or None when the streams have no
+    time or latlng data.
+
+    activity_streams is a dict row with at least the time and latlng columns.
+    """
+    if activity_streams is None:
+        return None
+    if activity_streams['time'] is None:
+        return None
+    if activity_streams['latlng'] is None:
+        return None
+    with metrics.timer('parse'):
+        lats, lons = streams.parse_latlng(activity_streams['latlng'])
+        offsets = streams.parse_times(activity_streams['time'])
+    metrics.count('samples', len(offsets))
+    return lats, lons, offsets
+
+
+def fetch_weather(start_date_time, lats, lons, offsets):
+    locations = sampling.select_locations(lats, lons)
+    end_date_time = start_date_time + timedelta(seconds=int(offsets[len(offsets)-1]))
+
+    metrics.count('sample_points', len(locations))
+    with metrics.timer('fetch'):
+        return WeatherBatch(locations).history(start_date_time=start_date_time, end_date_time=end_date_time)
+
+
+def blend_grid(activity_id, start_date_time, lats, lons, offsets, hour_start, grid_lats, grid_lons, values):
+    """
+    Blends the hourly weather grid onto the samples and encodes the weather row.
+
+    Only takes arrays and datetimes, so it can run in a worker process.
+    """
+    samples = None
+    if weather_resolution not in ('full', 'changes'):
+        # Only blend the samples that are stored
+        samples = resolution.interval_indices(offsets, int(weather_resolution))
+
+    with metrics.timer('interpolate'):
+        blended = interpolation.interpolate(lats, lons, offsets, start_date_time, hour_start,
+                                            grid_lats, grid_lons, values, samples=samples)
+
+    series = {variable: blended[:, i] for i, variable in enumerate(interpolation.VARIABLES)}
+    if weather_derived:
+        with metrics.timer('derive'):
+            series.update(derived.compute(blended, lats, lons, offsets, samples=samples))
+
+    with metrics.timer('encode'):
+        datainput = {"activity_id": activity_id}
+        for variable, values in series.items():
+            if samples is not None:
+                datainput[variable] = encoding.encode_series(values, indices=samples, count=len(offsets),
+                                                             linear=True)
+            elif weather_resolution == 'changes':
+                changes = resolution.change_indices(values)
+                datainput[variable] = encoding.encode_series(values[changes], indices=changes,
+                                                             count=len(offsets))
+            elif weather_format == 'binary':
+                datainput[variable] = encoding.encode_series(values)
+            else:
+                datainput[variable] = interpolation.format_series(values)
+    return datainput
+
+
+def blend_in_worker(*arguments):
+    """
+    Runs blend_grid in a worker process, where the invocation's metrics can not be reached.
+
+    Returns:
+    Tuple (row, timings) with the stage timings of blend_grid in
+    milliseconds, for metrics.add_timings in the parent.
+    """
+    worker = metrics.start()
+    return blend_grid(*arguments), worker.timings
+
+
+def insert_weather(db, rows):
+    """
+    Writes weather rows, returns whether the insert succeeded.
+
+    All rows are written in one transaction, so a failed insert leaves none behind.
+    """
+    metrics.count('rows_written', len(rows))
+    metrics.count('bytes_written', sum(len(value) for row in rows for value in row.values()
+                                       if isinstance(value, (str, bytes))))
+    with metrics.timer('insert'):
+        # Upserting on activity_id makes reruns replace the earlier row instead of adding a duplicate
+        return db.insert(table=weather_table, json_data=rows, mode=weather_insert_mode,
+                         batch_size=int(os.getenv('WEATHER_INSERT_BATCH', 50)), transaction=True)
+
+
+def prepare_weather(activity, activity_streams):
+    """
+    Parses the streams and fetches the weather grid for one activity.
+
+    Returns:
+    The arguments for blend_grid, or None when the streams have no time or
+    latlng data.
+    """
+    activity_id = activity[0]
+    start_date_time = activity[9]
+    parsed = parse_streams(activity_streams)
+    if parsed is None:
+        return None
+    lats, lons, offsets = parsed
+    measurements = fetch_weather(start_date_time, lats, lons, offsets)
+    with metrics.timer('grid'):
+        grid = interpolation.build_hourly_grid(measurements, variables=derived.COLUMNS if weather_derived else None)
+    metrics.count('grid_points', len(grid[1]))
+    return (activity_id, start_date_time, lats, lons, offsets) + grid
+
+
+def calculate_weather(activity, activity_streams):
+    """
+    Calculates the weather series for one activity.
+
+    Args:
+    activity: Row from the activity table.
+    activity_streams: Dict row with the STREAM_COLUMNS of the activity_streams table.
+
+    Returns:
+    The row for the weather table, or None when the streams have no time or
+    latlng data.
+    """
+    arguments = prepare_weather(activity, activity_streams)
+    if arguments is None:
+        return None
+    return blend_grid(*arguments)
+
+
+@profiling.profiled(correlation_filter)
+def lambda_handler(event, context):
+    setup_logging()
+    activity_id = event.get("activity_id")
+    log.info(f"Start handling laps for activity {activity_id}")
+    invocation = metrics.start(handler='lambda_handler', correlation_id=correlation_filter.correlation_id)
+    pool = database_pool()
+    db = pool.acquire()
+    try:
+        with metrics.timer('db_read'):
+            all_activities = db.get_specific(table='activity', where='id = %s', params=(activity_id,),
+                                             order_by_type='desc')
+        act_counter = 0
+        total_act = len(all_activities)
+        for activity in all_activities:
+            act_counter += 1
+            activity_id = activity[0]
+            log.info(f'Handling activity {activity_id} ({act_counter}/{total_act})')
+
+            with metrics.timer('db_read'):
+                rows = db.get_specific(table='activity_streams', columns=STREAM_COLUMNS, where='activity_id = %s',
+                                       params=(activity_id,), dictionary=True)
+            activity_streams = rows[0] if len(rows) > 0 else None
+            try:
+                datainput = calculate_weather(activity, activity_streams)
+            except Exception as e:
+                # Fail the invocation so Lambda retries it, instead of killing the runtime
+                log.error(f"Calculating weather for activity {activity_id} failed: {e}")
+                metrics.count('failures')
+                raise
+            if datainput is None:
+                continue
+
+            insert_weather(db, [datainput])
+    finally:
+        pool.release(db)
+        invocation.emit()
+
+
+def batch_records(event):
+    """
+    Returns (identifier, activity_id) pairs from a batch event.
+
+    The event either has an "activity_ids" list or SQS style "Records", whose
+    body is an activity id or a json object with an "activity_id".
+    """
+    if 'Records' in event:
+        records = []
+        for record in event['Records']:
+            body = record.get('body', '')
+            try:
+                body = json.loads(body)
+            except ValueError:
+                pass
+            if isinstance(body, dict):
+                body = body.get('activity_id')
+            records.append((record.get('messageId'), body))
+        return records
+    return [(activity_id, activity_id) for activity_id in event.get('activity_ids', [])]
+
+
+def process_chunk(db, chunk, executor=None):
+    """
+    Calculates and stores the weather for a chunk of activities.
+
+    Activities and streams are read with one IN (...) query each and the
+    results are written with one bulk insert.
+
+    With an executor the streams are parsed and the weather is fetched here,
+    while the blending runs in the executor's worker processes. The rows are
+    still written in chunk order.
+
+    Args:
+    db: Connection to use.
+    chunk: List of (identifier, activity_id) pairs.
+    executor: Optional concurrent.futures process executor that runs blend_grid.
+        The interpolate, derive and encode timings of its workers are added to
+        the metrics as well.
+
+    Returns:
+    The identifiers of the activities that failed.
+    """
+    ids = [activity_id for identifier, activity_id in chunk]
+    placeholders = ', '.join(['%s'] * len(ids))
+    with metrics.timer('db_read'):
+        activities = db.get_specific(table='activity', where=f'id IN ({placeholders})', params=ids)
+        streams = db.get_specific(table='activity_streams', columns=STREAM_COLUMNS,
+                                  where=f'activity_id IN ({placeholders})', params=ids, dictionary=True)
+    if isinstance(activities, Exception) or isinstance(streams, Exception):
+        log.error(f"Loading activities failed: {activities if isinstance(activities, Exception) else streams}")
+        return [identifier for identifier, activity_id in chunk]
+
+    activities = {activity[0]: activity for activity in activities}
+    activity_streams = {}
+    for row in streams:
+        activity_streams.setdefault(row['activity_id'], row)
+
+    failures = []
+    jobs = []
+    for identifier, activity_id in chunk:
+        if activity_id not in activities:
+            log.error(f"Activity {activity_id} not found")
+            failures.append(identifier)
             continue
-        if activity_streams[5] is None:
+        try:
+            arguments = prepare_weather(activities[activity_id], activity_streams.get(activity_id))
+            if arguments is None:
+                log.info(f"Activity {activity_id} has no streams to handle")
+                continue
+            if executor is None:
+                job = blend_grid(*arguments)
+            else:
+                job = executor.submit(blend_in_worker, *arguments)
+        except Exception as e:
+            log.error(f"Calculating weather for activity {activity_id} failed: {e}")
+            failures.append(identifier)
             continue
-        activity_latlngs = activity_streams[5].split('],[')
-        activity_latlngs = activity_latlngs[1:]
-        activity_latlngs[len(activity_latlngs)-1] = activity_latlngs[len(activity_latlngs)-1][:-1]
-        activity_times = activity_streams[2].split(',')
-        percentage_size = 10
-        percentage_step = math.floor(len(activity_latlngs) / percentage_size)
-        measures = []
-        for i in range(0, percentage_size):
-            measure = activity_latlngs[i*percentage_step]
-            measures.append(measure)
-
-        date_times = []
-        for activity_time in activity_times:
-            date_times.append(start_date_time + timedelta(seconds=int(activity_time)))
-
-        end_date_time = str(date_times[len(date_times)-1])
-
-        all_measurements = {}
-        for measure in measures:
-            lat = measure.split(',')[0].strip()
-            lon = measure.split(',')[1].strip()
-            # print(f'lat = {lat}, lon = {lon}')
-            weather = Weather(lat=lat, lon=lon)
-            measured_weather = None
-            try:
-                measured_weather = weather.history(start_date=start_date_time.date(),
-                                                   end_date=(datetime.strptime(end_date_time, '%Y-%m-%d %H:%M:%S') +
-                                                             timedelta(days=1)).date())
+        jobs.append((identifier, activity_id, job))
 
+    rows = []
+    row_identifiers = []
+    for identifier, activity_id, job in jobs:
+        if executor is not None:
+            try:
+                with metrics.timer('blend_wait'):
+                    job, timings = job.result()
+                metrics.add_timings(timings)
             except Exception as e:
-                log.error(end_date_time)
-                log.error(e)
-                exit()
-            # print(measured_weather)
-            for i in range(0, len(measured_weather['hourly']['time'])):
-                time = measured_weather['hourly']['time'][i]
-                temp = measured_weather['hourly']['temperature_2m'][i]
-                humidity = measured_weather['hourly']['relative_humidity_2m'][i]
-                air_pressure = measured_weather['hourly']['surface_pressure'][i]
+                log.error(f"Calculating weather for activity {activity_id} failed: {e}")
+                failures.append(identifier)
+                continue
+        rows.append(job)
+        row_identifiers.append(identifier)
+
+    if len(rows) > 0 and not insert_weather(db, rows):
+        failures.extend(row_identifiers)
+    return failures
+
+
+@profiling.profiled(correlation_filter)
+def batch_handler(event, context):
+    """
+    Calculates the weather for many activities at once.
+
+    The activities are handled by process_chunk in chunks of BATCH_CHUNK_SIZE.
+    A failing activity only fails its own record.
+
+    Returns:
+    SQS partial batch response: {"batchItemFailures": [{"itemIdentifier": ...}]}
+    """
+    setup_logging()
+    records = batch_records(event)
+    chunk_size = int(os.getenv('BATCH_CHUNK_SIZE', 200))
+    log.info(f"Start handling weather for {len(records)} activities")
+    invocation = metrics.start(handler='batch_handler', correlation_id=correlation_filter.correlation_id)
+    metrics.count('activities', len(records))
+
+    failures = []
+    pool = database_pool()
+    db = pool.acquire()
+    try:
+        for start in range(0, len(records), chunk_size):
+            chunk = []
+            for identifier, activity_id in records[start:start + chunk_size]:
                 try:
-                    wet_bulb = calculate_wet_bulb(float(temp), float(humidity))
-                except Exception as e:
-                    wet_bulb = 9999
-                    log.info(activity_id)
-                    log.info(measured_weather)
-                    exit()
-                apparent_temp = measured_weather['hourly']['apparent_temperature'][i]
-                wind_speed = measured_weather['hourly']['wind_speed_10m'][i]
-                wind_direction = measured_weather['hourly']['wind_direction_10m'][i]
-                weather_code = measured_weather['hourly']['weather_code'][i]
-                if measured_weather['hourly']['time'][i] not in all_measurements:
-                    all_measurements[time] = {}
-
-                latitude = measured_weather['latitude']
-                longitude = measured_weather['longitude']
-                lanlon = f'{latitude},{longitude}'
-                if lanlon not in all_measurements[time]:
-                    all_measurements[time][lanlon] = {
-                        "temp": temp,
-                        "weather_code": weather_code,
-                        "wet_bulb": wet_bulb,
-                        "wind_direction": wind_direction,
-                        "wind_speed": wind_speed,
-                        "apparent_temp": apparent_temp,
-                        "humidity": humidity,
-                        "air_pressure": air_pressure
-                    }
-
-        # print(json.dumps(all_measurements))
-
-        temp = []
-        wet_bulb = []
-        wind_direction = []
-        wind_speed = []
-        apparent_temp = []
-        humidity = []
-        air_pressure = []
-
-        # activity_latlngs = ['51.955341, 4.212948']
-        # activity_times = [datetime(2024, 7, 20, 14, 30, 2)]
-        for t in range(0, len(activity_times)):
-            correction = 0
-            temp.append(0)
-            wet_bulb.append(0)
-            wind_direction.append(0)
-            wind_speed.append(0)
-            apparent_temp.append(0)
-            humidity.append(0)
-            air_pressure.append(0)
-            while len(activity_latlngs) <= t-correction:
-                correction += 1
-
-            lat_check = float(activity_latlngs[t-correction].split(',')[0].strip())
-            lon_check = float(activity_latlngs[t-correction].split(',')[1].strip())
-            datetime_compare = date_times[t]
-            # lat_check = 51.955341
-            # lon_check = 4.212948
-            # datetime_compare = datetime(2024, 7, 20, 14, 30, 2)
-            start_of_hour = datetime_compare.replace(minute=0, second=0, microsecond=0)
-            start_of_next_hour = start_of_hour + timedelta(hours=1)
-            diff_start_hour = (datetime_compare - start_of_hour).total_seconds()
-            diff_next_hour = (start_of_next_hour - datetime_compare).total_seconds()
-
-            start_hour_contribution = (3600 - diff_start_hour) / 3600
-            next_hour_contribution = (3600 - diff_next_hour) / 3600
-            datetime_start = start_of_hour.strftime('%Y-%m-%dT%H:%M')
-            datetime_end = start_of_next_hour.strftime('%Y-%m-%dT%H:%M')
-
-            datetimes = [datetime_start, datetime_end]
-            contributions = [start_hour_contribution, next_hour_contribution]
-            data = all_measurements
-
-            for i in range(0, len(datetimes)):
-                contribution = contributions[i]
-                datetimevalue = datetimes[i]
-
-                distance_product = 1
-                distances = []
-                for latlon in data[datetimevalue]:
-                    lat = float(latlon.split(',')[0])
-                    lon = float(latlon.split(',')[1])
-                    distance = haversine_afstand(lat_check, lon_check, lat, lon)
-                    distances.append(distance)
-                    distance_product *= distance
-
-                temp_total = 0
-                wet_bulb_total = 0
-                wind_direction_total = 0
-                wind_speed_total = 0
-                apparent_temp_total = 0
-                humidity_total = 0
-                air_pressure_total = 0
-                total_parts = 0
-                counter = 0
-                for latlon in data[datetimevalue]:
-                    part = distance_product / distances[counter]
-                    temp_total += data[datetimevalue][latlon]['temp'] * part
-
-                    wet_bulb_total += data[datetimevalue][latlon]['wet_bulb'] * part
-                    wind_direction_total += data[datetimevalue][latlon]['wind_direction'] * part
-                    wind_speed_total += data[datetimevalue][latlon]['wind_speed'] * part
-                    apparent_temp_total += data[datetimevalue][latlon]['apparent_temp'] * part
-                    humidity_total += data[datetimevalue][latlon]['humidity'] * part
-                    air_pressure_total += data[datetimevalue][latlon]['air_pressure'] * part
-
-                    total_parts += part
-
-                    counter += 1
-
-                temp[t] += temp_total/total_parts*contribution
-                wet_bulb[t] += wet_bulb_total/total_parts*contribution
-                wind_direction[t] += wind_direction_total/total_parts*contribution
-                wind_speed[t] += wind_speed_total/total_parts*contribution
-                apparent_temp[t] += apparent_temp_total/total_parts*contribution
-                humidity[t] += humidity_total/total_parts*contribution
-                air_pressure[t] += air_pressure_total/total_parts*contribution
-
-            temp[t] = str(round(temp[t], 1))
-            wet_bulb[t] = str(round(wet_bulb[t], 1))
-            wind_direction[t] = str(round(wind_direction[t], 1))
-            wind_speed[t] = str(round(wind_speed[t], 1))
-            apparent_temp[t] = str(round(apparent_temp[t], 1))
-            humidity[t] = str(round(humidity[t], 1))
-            air_pressure[t] = str(round(air_pressure[t], 1))
-
-        datainput = {
-            "activity_id": activity_id,
-            "temp": ', '.join(temp),
-            "wet_bulb": ', '.join(wet_bulb),
-            "wind_direction": ', '.join(wind_direction),
-            "wind_speed": ', '.join(wind_speed),
-            "apparent_temp": ', '.join(apparent_temp),
-            "humidity": ', '.join(humidity),
-            "air_pressure": ', '.join(air_pressure)
-        }
-
-        db.insert(table=weather_table, json_data=datainput)
+                    chunk.append((identifier, int(activity_id)))
+                except (TypeError, ValueError):
+                    log.error(f"Invalid activity id {activity_id}")
+                    failures.append(identifier)
+            if len(chunk) == 0:
+                continue
+
+            failures.extend(process_chunk(db, chunk))
+    finally:
+        pool.release(db)
+        metrics.count('failures', len(failures))
+        invocation.emit()
+
+    log.info(f"Handled {len(records) - len(failures)} of {len(records)} activities")
+    return {"batchItemFailures": [{"itemIdentifier": identifier} for identifier in failures]}
+
+
+def pending_activities(db, after_id, limit):
+    """
+    Returns up to limit ids above after_id that have no weather row yet, in id order.
+    """
+    with metrics.timer('db_read'):
+        rows = db.get_specific(custom=f"SELECT a.id FROM activity a LEFT JOIN {weather_table} w "
+                                      f"ON w.activity_id = a.id WHERE w.activity_id IS NULL AND a.id > %s "
+                                      f"ORDER BY a.id asc LIMIT %s", params=(int(after_id), int(limit)), prepared=True)
+    if isinstance(rows, Exception):
+        raise rows
+    return [row[0] for row in rows]
+
+
+def backfill(chunk_size=None, state_table=None, state_id=None, restart=False, should_stop=None, workers=None):
+    """
+    Calculates the weather for every activity that has none yet.
+
+    Pending activities are found with an anti-join against WEATHER_TABLE and
+    walked in id order, chunk_size at a time. After every chunk the highest
+    handled id is stored in DynamoDB, so an interrupted run continues after it
+    instead of scanning from the start. Activities that fail are logged and
+    skipped; run with restart=True to pick them up again.
+
+    With more than one worker the blending runs in a process pool, the
+    database and Open-Meteo calls stay in this process.
+
+    Args:
+    chunk_size: Activities per chunk, defaults to BACKFILL_CHUNK_SIZE (200).
+    state_table: DynamoDB table holding the high-water mark, defaults to BACKFILL_TABLE.
+    state_id: Item id of the high-water mark, defaults to BACKFILL_ID.
+    restart: Ignore the stored high-water mark and start from the first activity.
+    should_stop: Optional callable, checked between chunks, that ends the run when it returns True.
+    workers: Worker processes for the blending, defaults to BACKFILL_WORKERS (1, no pool).
+
+    Returns:
+    Summary dict with the handled and failed counts, the high-water mark and the throughput.
+    """
+    setup_logging()
+    if chunk_size is None:
+        chunk_size = int(os.getenv('BACKFILL_CHUNK_SIZE', 200))
+    if state_table is None:
+        state_table = os.getenv('BACKFILL_TABLE', 'backfill_state')
+    if state_id is None:
+        state_id = os.getenv('BACKFILL_ID', f'weather_{weather_table}')
+    if workers is None:
+        workers = int(os.getenv('BACKFILL_WORKERS', 1))
+
+    last_id = 0
+    if not restart:
+        state = aws.dynamodb_query(table=state_table, id=state_id)
+        if len(state) > 0:
+            last_id = int(state[0].get('last_activity_id', 0))
+    log.info(f"Start backfill after activity {last_id} in chunks of {chunk_size} with {workers} worker(s)")
+    invocation = metrics.start(handler='backfill', correlation_id=correlation_filter.correlation_id)
+
+    handled = 0
+    failed = 0
+    started = time.monotonic()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pool = database_pool()
+    db = pool.acquire()
+    try:
+        while should_stop is None or not should_stop():
+            activity_ids = pending_activities(db, last_id, chunk_size)
+            if len(activity_ids) == 0:
+                log.info("No pending activities left")
+                break
+
+            chunk_started = time.monotonic()
+            failures = process_chunk(db, [(activity_id, activity_id) for activity_id in activity_ids], executor)
+            handled += len(activity_ids) - len(failures)
+            failed += len(failures)
+            if len(failures) > 0:
+                log.error(f"Backfill failed for activities {failures}")
+
+            last_id = activity_ids[-1]
+            result = aws.dynamo_db_update(table=state_table, item_id=state_id, attribute='last_activity_id',
+                                          value=last_id)
+            if result != "ok":
+                log.error(f"Storing backfill high-water mark failed: {result}")
+
+            elapsed = time.monotonic() - started
+            log.info(f"Backfilled up to activity {last_id}: {len(activity_ids)} in "
+                     f"{time.monotonic() - chunk_started:.1f}s, {handled + failed} total at "
+                     f"{(handled + failed) / elapsed:.2f} activities/s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        pool.release(db)
+        metrics.count('activities', handled + failed)
+        metrics.count('failures', failed)
+        invocation.emit()
+
+    elapsed = time.monotonic() - started
+    return {
+        "handled": handled,
+        "failed": failed,
+        "last_activity_id": last_id,
+        "seconds": round(elapsed, 1),
+        "activities_per_second": round((handled + failed) / elapsed, 2) if elapsed > 0 else 0
+    }
+
+
+@profiling.profiled(correlation_filter)
+def backfill_handler(event, context):
+    """
+    Lambda entry point for backfill, stops before the invocation times out.
+
+    The next invocation resumes from the stored high-water mark.
+    """
+    margin = int(os.getenv('BACKFILL_MARGIN_MS', 60000))
+
+    def should_stop():
+        return context is not None and context.get_remaining_time_in_millis() < margin
+
+    return backfill(chunk_size=event.get('chunk_size'), restart=event.get('restart', False), should_stop=should_stop)
 
 #
 #
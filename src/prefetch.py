@@ -0,0 +1,74 @@
+"""
+Fills the hourly weather store (WEATHER_STORE_PATH) with whole archive years:
+
+    python src/prefetch.py --activities
+    python src/prefetch.py --location 51.95,4.21 --years 2022 2023 2024
+
+With --activities the weather sample points and years of every stored activity
+are collected first, so a backfill afterwards needs no Open-Meteo calls.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import main as handler  # noqa: E402
+from supporting import sampling  # noqa: E402
+from supporting import streams  # noqa: E402
+from supporting.hourly_store import HourlyStore  # noqa: E402
+
+
+def activity_locations(db):
+    """
+    Returns {year: set of (lat, lon)} with the weather sample points of every activity.
+    """
+    years = {}
+    for activity in db.iter_all(table='activity'):
+        years[activity[0]] = activity[9].year
+    locations = {}
+    for row in db.iter_specific(table='activity_streams', columns=['activity_id', 'latlng'], order_by='activity_id',
+                                dictionary=True):
+        if row['latlng'] is None or row['activity_id'] not in years:
+            continue
+        lats, lons = streams.parse_latlng(row['latlng'])
+        locations.setdefault(years[row['activity_id']], set()).update(sampling.select_locations(lats, lons))
+    return locations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the hourly weather store with whole archive years.")
+    parser.add_argument('--path', help='store directory (WEATHER_STORE_PATH)')
+    parser.add_argument('--activities', action='store_true', help='store the locations and years of all activities')
+    parser.add_argument('--location', action='append', default=[], help='LAT,LON to store, can be repeated')
+    parser.add_argument('--years', type=int, nargs='*', default=[], help='years to store for every --location')
+    args = parser.parse_args(argv)
+    if not args.path and not os.getenv('WEATHER_STORE_PATH'):
+        parser.error('--path is required when WEATHER_STORE_PATH is not set')
+
+    handler.setup_logging()
+    store = HourlyStore(path=args.path)
+    locations = {}
+    for location in args.location:
+        lat, lon = (float(value) for value in location.split(','))
+        for year in args.years:
+            locations.setdefault(year, set()).add((lat, lon))
+
+    if args.activities:
+        pool = handler.database_pool()
+        db = pool.acquire()
+        try:
+            for year, points in activity_locations(db).items():
+                locations.setdefault(year, set()).update(points)
+        finally:
+            pool.release(db)
+
+    requests = 0
+    for year in sorted(locations):
+        requests += store.prefetch(sorted(locations[year]), [year])
+    print(json.dumps({"years": sorted(locations), "cells": len(store.cells), "requests": requests}))
+
+
+if __name__ == '__main__':
+    main()
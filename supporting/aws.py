@@ -1,11 +1,20 @@
-import boto3
-from boto3.dynamodb.conditions import Attr
-from botocore.exceptions import ClientError
+# boto3 is imported on first use, it is the slowest import of the handler
+dynamodb = None
+
+
+def dynamodb_resource():
+    # The resource is kept between warm invocations
+    global dynamodb
+    if dynamodb is None:
+        import boto3
+        dynamodb = boto3.resource('dynamodb')
+    return dynamodb
 
 
 def dynamodb_query(table, id=''):
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table)
+    from boto3.dynamodb.conditions import Attr
+
+    table = dynamodb_resource().Table(table)
 
     # Scan the table with a filter to get items where 'check' is True
     response = table.scan(
@@ -18,8 +27,9 @@ def dynamodb_query(table, id=''):
 
 
 def dynamo_db_update(table, item_id='', attribute='', value=''):
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table)
+    from botocore.exceptions import ClientError
+
+    table = dynamodb_resource().Table(table)
     try:
         # Update the item with id = '123', setting the value attribute
         response = table.update_item(
@@ -39,3 +49,16 @@ def dynamo_db_update(table, item_id='', attribute='', value=''):
         return e.response['Error']['Message']
     except Exception as e:
         return str(e)
+
+
+def s3_upload(file_path, bucket, key):
+    import boto3
+    from botocore.exceptions import ClientError
+
+    try:
+        boto3.client('s3').upload_file(file_path, bucket, key)
+        return "ok"
+    except ClientError as e:
+        return e.response['Error']['Message']
+    except Exception as e:
+        return str(e)
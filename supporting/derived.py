@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+
+from supporting.interpolation import DERIVED_INPUTS, VARIABLES
+
+
+# Extra weather series, stored in columns with the same name
+DERIVED = ['dew_point', 'heat_index', 'headwind', 'crosswind']
+
+# Columns of the blended array compute expects
+COLUMNS = VARIABLES + DERIVED_INPUTS
+
+
+def heat_index(temp, rh):
+    """
+    Heat index in degrees Celsius (NWS Rothfusz regression with its adjustments).
+
+    Below 80 F the simple Steadman formula is used, which is close to the
+    temperature itself.
+    """
+    t = temp * 9 / 5 + 32
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = -42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh - 0.00683783 * t * t - \
+        0.05481717 * rh * rh + 0.00122874 * t * t * rh + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh
+    dry = (rh < 13) & (t >= 80) & (t <= 112)
+    full = np.where(dry, full - (13 - rh) / 4 * np.sqrt(np.maximum(17 - np.abs(t - 95), 0) / 17), full)
+    humid = (rh > 85) & (t >= 80) & (t <= 87)
+    full = np.where(humid, full + (rh - 85) / 10 * (87 - t) / 5, full)
+    fahrenheit = np.where((simple + t) / 2 < 80, simple, full)
+    return (fahrenheit - 32) * 5 / 9
+
+
+def bearing(lats, lons, window=None):
+    """
+    Direction of travel in degrees (0 is north, 90 east) for every position.
+
+    The bearing of a position is taken from window positions before it to
+    window positions after it, which smooths GPS noise. Positions where the
+    route does not move keep the bearing of the position before them.
+
+    Args:
+    lats: Latitudes of the route in degrees.
+    lons: Longitudes of the route in degrees.
+    window: Positions on either side, defaults to BEARING_WINDOW (5).
+    """
+    if window is None:
+        window = int(os.getenv('BEARING_WINDOW', 5))
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    if len(lats) == 0:
+        return np.empty(0, dtype=np.float64)
+
+    index = np.arange(len(lats))
+    start = np.maximum(index - window, 0)
+    end = np.minimum(index + window, len(lats) - 1)
+    dlon = lons[end] - lons[start]
+    y = np.sin(dlon) * np.cos(lats[end])
+    x = np.cos(lats[start]) * np.sin(lats[end]) - np.sin(lats[start]) * np.cos(lats[end]) * np.cos(dlon)
+    degrees = np.degrees(np.arctan2(y, x)) % 360
+
+    # Carry the last known bearing over stops, a route that never moves faces north
+    moving = (x != 0) | (y != 0)
+    last = np.maximum.accumulate(np.where(moving, index, -1))
+    return np.where(last >= 0, degrees[np.maximum(last, 0)], 0.0)
+
+
+def wind_components(wind_u, wind_v, heading):
+    """
+    Splits the wind into headwind and crosswind relative to the direction of travel.
+
+    wind_u and wind_v are the eastward and northward vector the wind blows
+    along (see interpolation.wind_vector). A positive headwind blows against
+    the rider, a negative one is a tailwind. A positive crosswind comes from
+    the right.
+
+    Returns:
+    Tuple (headwind, crosswind) in the unit of the wind vector.
+    """
+    heading = np.radians(heading)
+    sin = np.sin(heading)
+    cos = np.cos(heading)
+    return -(wind_u * sin + wind_v * cos), wind_v * sin - wind_u * cos
+
+
+def compute(blended, lats, lons, offsets, samples=None):
+    """
+    Computes the DERIVED series from the blended weather in one pass.
+
+    Args:
+    blended: Array of shape (samples, COLUMNS) from interpolation.interpolate,
+        on a grid built with the DERIVED_INPUTS.
+    lats: Latitudes of the stream samples in degrees.
+    lons: Longitudes of the stream samples in degrees.
+    offsets: Time offsets of the stream samples, positions are matched to
+        them like interpolate does.
+    samples: The sample indices blended was computed for, or None for all.
+
+    Returns:
+    Dict of arrays keyed by the DERIVED names, aligned with the rows of blended.
+    """
+    temp = blended[:, COLUMNS.index('temp')]
+    humidity = blended[:, COLUMNS.index('humidity')]
+
+    position = np.minimum(np.arange(len(offsets)), len(lats) - 1)
+    if samples is not None:
+        position = position[samples]
+    heading = bearing(lats, lons)[position]
+    headwind, crosswind = wind_components(blended[:, COLUMNS.index('wind_u')], blended[:, COLUMNS.index('wind_v')],
+                                          heading)
+    return {
+        'dew_point': blended[:, COLUMNS.index('dew_point')],
+        'heat_index': heat_index(temp, humidity),
+        'headwind': headwind,
+        'crosswind': crosswind
+    }
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from supporting.open_meteo import HOURLY_VARIABLES, Weather
+
+
+log = logging.getLogger()
+
+# Archive data is complete up to this many days ago, newer days come from the forecast
+ARCHIVE_DELAY_DAYS = 7
+
+
+def hours_in_year(year):
+    return (date(year + 1, 1, 1) - date(year, 1, 1)).days * 24
+
+
+class HourlyStore:
+    """
+    Local columnar store of archived hourly Open-Meteo data.
+
+    Every grid cell gets one file per year with a float64 array of shape
+    (variables, hours), variables in the order of open_meteo.HOURLY_VARIABLES
+    and hours counted from January 1st 00:00 GMT. Hours that are not filled
+    hold NaN. The files are memory-mapped, so a query only slices the hours it
+    needs without copying them.
+
+    Requested coordinates are resolved to a grid cell by the grid square of
+    grid degrees they fall in, like sampling.select_locations groups them. The
+    mapping is kept in cells.json next to the cell directories.
+
+    The store is filled with whole years by fill or prefetch, with one archive
+    request per cell per year through Weather.history.
+    """
+
+    def __init__(self, path=None, grid=None):
+        self.path = path or os.getenv('WEATHER_STORE_PATH')
+        if not self.path:
+            raise ValueError("HourlyStore needs a path or WEATHER_STORE_PATH")
+        if grid is None:
+            grid = float(os.getenv('OPEN_METEO_GRID', 0.1))
+        self.grid = grid
+        self.lock = threading.Lock()
+        self.arrays = {}
+        os.makedirs(self.path, exist_ok=True)
+        self.index_path = os.path.join(self.path, 'cells.json')
+        self.cells = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.cells = json.load(file)
+
+    def key(self, lat, lon):
+        return f"{round(lat / self.grid)},{round(lon / self.grid)}"
+
+    def cell(self, lat, lon):
+        """
+        Returns the (latitude, longitude) of the stored grid cell for a location, or None.
+        """
+        cell = self.cells.get(self.key(lat, lon))
+        return None if cell is None else tuple(cell)
+
+    def file(self, latitude, longitude, year):
+        return os.path.join(self.path, f"{latitude:.4f}_{longitude:.4f}", f"{year}.f8")
+
+    def array(self, latitude, longitude, year):
+        """
+        Returns the memory-mapped (variables, hours) array of a cell and year, or None.
+        """
+        path = self.file(latitude, longitude, year)
+        with self.lock:
+            values = self.arrays.get(path)
+            if values is None and os.path.exists(path):
+                values = np.memmap(path, dtype=np.float64, mode='r', shape=(len(HOURLY_VARIABLES), hours_in_year(year)))
+                self.arrays[path] = values
+        return values
+
+    def hourly(self, latitude, longitude, start_date, end_date):
+        """
+        Returns the hourly series of a cell from start_date 00:00 up to end_date 23:00.
+
+        The series are views on the memory-mapped file. A range that crosses a
+        new year is joined into a copy.
+
+        Returns:
+        Dict of arrays keyed by the Open-Meteo variable name, or None when any
+        of the hours is not stored.
+        """
+        parts = []
+        for year in range(start_date.year, end_date.year + 1):
+            values = self.array(latitude, longitude, year)
+            if values is None:
+                return None
+            first = max(start_date, date(year, 1, 1))
+            last = min(end_date, date(year, 12, 31))
+            start = (first - date(year, 1, 1)).days * 24
+            end = ((last - date(year, 1, 1)).days + 1) * 24
+            parts.append(values[:, start:end])
+        values = parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+        if np.isnan(values).any():
+            return None
+        return {name: values[i] for i, name in enumerate(HOURLY_VARIABLES)}
+
+    def history(self, lat, lon, start_date, end_date):
+        """
+        Answers a Weather.history request from the store.
+
+        Returns:
+        A response shaped like Weather.history with array series, or None when
+        the location or any of the hours is not stored.
+        """
+        cell = self.cell(lat, lon)
+        if cell is None:
+            return None
+        hourly = self.hourly(cell[0], cell[1], start_date, end_date)
+        if hourly is None:
+            return None
+        start = datetime(start_date.year, start_date.month, start_date.day)
+        hourly['time'] = [(start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M')
+                          for hour in range(len(hourly[next(iter(hourly))]))]
+        return {"latitude": cell[0], "longitude": cell[1], "hourly": hourly}
+
+    def complete(self, lat, lon, year):
+        """
+        Whether the year of a location is stored and can not change anymore.
+        """
+        cell = self.cell(lat, lon)
+        if cell is None or not os.path.exists(self.file(cell[0], cell[1], year)):
+            return False
+        return date(year, 12, 31) < date.today() - timedelta(days=ARCHIVE_DELAY_DAYS)
+
+    def fill(self, lat, lon, year):
+        """
+        Fetches a whole year of a location from the archive and stores it.
+
+        Returns:
+        The (latitude, longitude) of the grid cell, or None when no day of the
+        year is in the archive yet.
+        """
+        first = date(year, 1, 1)
+        last = min(date(year, 12, 31), date.today() - timedelta(days=ARCHIVE_DELAY_DAYS))
+        if last < first:
+            return None
+
+        measured_weather = Weather(lon, lat, cache=False).history(first, last)
+        latitude = measured_weather['latitude']
+        longitude = measured_weather['longitude']
+        values = np.full((len(HOURLY_VARIABLES), hours_in_year(year)), np.nan)
+        for i, name in enumerate(HOURLY_VARIABLES):
+            series = np.array(measured_weather['hourly'][name], dtype=np.float64)
+            values[i, :len(series)] = series
+
+        path = self.file(latitude, longitude, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        values.tofile(path + '.tmp')
+        with self.lock:
+            # Replacing the file keeps earlier maps of it valid
+            os.replace(path + '.tmp', path)
+            self.arrays.pop(path, None)
+            self.cells[self.key(lat, lon)] = [latitude, longitude]
+            with open(self.index_path + '.tmp', 'w') as file:
+                json.dump(self.cells, file)
+            os.replace(self.index_path + '.tmp', self.index_path)
+        return latitude, longitude
+
+    def prefetch(self, locations, years):
+        """
+        Fills every year of every location that is not complete yet.
+
+        Locations in the same grid square are fetched once.
+
+        Args:
+        locations: List of (lat, lon) tuples.
+        years: Years to store.
+
+        Returns:
+        Number of yearly archive requests made.
+        """
+        requests = 0
+        keys = set()
+        for lat, lon in locations:
+            key = self.key(lat, lon)
+            if key in keys:
+                continue
+            keys.add(key)
+            for year in years:
+                if self.complete(lat, lon, year):
+                    continue
+                if self.fill(lat, lon, year) is not None:
+                    requests += 1
+                    log.info(f"Stored {year} of grid cell {self.cells[key]}")
+        return requests
+
+
+hourly_store = None
+
+
+def get_store():
+    """
+    Returns the module level store, or None when WEATHER_STORE_PATH is not set.
+    """
+    global hourly_store
+    if not os.getenv('WEATHER_STORE_PATH'):
+        return None
+    if hourly_store is None:
+        hourly_store = HourlyStore()
+    return hourly_store
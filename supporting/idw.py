@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+
+
+# Straal van de aarde in kilometers
+EARTH_RADIUS = 6371.0
+
+# A sample closer than this to a grid point takes that point's weather as is
+EXACT_HIT_KM = 1e-6
+
+# Samples per query step, bounds the (samples, points) temporary arrays
+CHUNK_SIZE = 1024
+
+
+def unit_vectors(lats, lons):
+    """
+    Converts degrees to (n, 3) points on the unit sphere.
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+class SphereIndex:
+    """
+    Nearest neighbour index over weather grid points.
+
+    The points are stored once as unit-sphere vectors. A query ranks the
+    points by their dot product with the sample, keeps the k nearest with
+    argpartition and converts their straight-line (chord) distance to
+    great-circle kilometers. The chord is computed from the vector difference,
+    which stays precise for points a few meters apart. Samples are handled in
+    chunks so memory does not grow with the route.
+    """
+
+    def __init__(self, lats, lons):
+        self.points = unit_vectors(lats, lons)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, lats, lons, k=None, chunk_size=CHUNK_SIZE):
+        """
+        Finds the k nearest grid points of every sample.
+
+        Args:
+        lats: Latitudes of the samples in degrees.
+        lons: Longitudes of the samples in degrees.
+        k: Number of neighbours, all points when None, 0 or more than there are.
+        chunk_size: Samples per step.
+
+        Returns:
+        Tuple (distances, indices) of shape (samples, k), distances in
+        kilometers. The neighbours are not sorted by distance. indices is None
+        when every point is a neighbour, the distances are then in point order.
+        """
+        samples = unit_vectors(lats, lons)
+        everything = not k or k >= len(self.points)
+        if everything:
+            k = len(self.points)
+        distances = np.empty((len(samples), k), dtype=np.float64)
+        indices = None if everything else np.empty((len(samples), k), dtype=np.intp)
+        for start in range(0, len(samples), chunk_size):
+            chunk = samples[start:start + chunk_size]
+            if everything:
+                neighbours = self.points[None, :, :]
+            else:
+                # The nearest points have the largest dot product, a single matrix product
+                nearest = np.argpartition(-(chunk @ self.points.T), k - 1, axis=1)[:, :k]
+                indices[start:start + len(chunk)] = nearest
+                neighbours = self.points[nearest]
+            chord = np.sqrt(np.square(chunk[:, None, :] - neighbours).sum(axis=-1))
+            distances[start:start + len(chunk)] = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1))
+        return distances, indices
+
+
+def weights(distances, power=1):
+    """
+    Normalized inverse-distance weights 1 / d^power per row.
+
+    A row with a distance below EXACT_HIT_KM gives all weight to that point
+    (split evenly when several points coincide) instead of dividing by zero.
+    """
+    exact = distances < EXACT_HIT_KM
+    inverse = 1 / np.where(exact, 1, distances)
+    if power != 1:
+        inverse = np.power(inverse, power)
+    hits = exact.any(axis=1)
+    inverse[hits] = exact[hits]
+    return inverse / inverse.sum(axis=1, keepdims=True)
+
+
+def neighbour_weights(index, lats, lons, k=None, power=None):
+    """
+    Returns (weights, indices) of shape (samples, k) for blending grid point values.
+
+    indices is None when every grid point is blended.
+
+    Args:
+    index: SphereIndex of the grid points.
+    lats: Latitudes of the samples in degrees.
+    lons: Longitudes of the samples in degrees.
+    k: Neighbours per sample, defaults to IDW_NEIGHBOURS (0, every point).
+    power: Distance power, defaults to IDW_POWER (1).
+    """
+    if k is None:
+        k = int(os.getenv('IDW_NEIGHBOURS', 0))
+    if power is None:
+        power = float(os.getenv('IDW_POWER', 1))
+    distances, indices = index.query(lats, lons, k=k)
+    return weights(distances, power), indices
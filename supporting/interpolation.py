@@ -0,0 +1,172 @@
+from datetime import datetime
+
+import numpy as np
+
+from supporting import idw
+
+
+# Straal van de aarde in kilometers
+EARTH_RADIUS = 6371.0
+
+# Order of the variables along the last axis of the hourly weather array
+VARIABLES = ['temp', 'wet_bulb', 'wind_direction', 'wind_speed', 'apparent_temp', 'humidity', 'air_pressure']
+
+# Open-Meteo hourly keys that feed VARIABLES (wet_bulb is derived)
+HOURLY_KEYS = {
+    'temp': 'temperature_2m',
+    'wind_direction': 'wind_direction_10m',
+    'wind_speed': 'wind_speed_10m',
+    'apparent_temp': 'apparent_temperature',
+    'humidity': 'relative_humidity_2m',
+    'air_pressure': 'surface_pressure'
+}
+
+# Grid variables that only derived.compute needs, blended after VARIABLES when asked for.
+# The wind is blended as its eastward (u) and northward (v) vector, averaging
+# directions like 350 and 10 degrees would point it south.
+DERIVED_INPUTS = ['dew_point', 'wind_u', 'wind_v']
+
+
+def wet_bulb(temp, rh):
+    """
+    Vectorized version of calculate_wet_bulb, rounded to one decimal.
+    """
+    tw = temp * np.arctan(0.151977 * np.power(rh + 8.313659, 0.5)) + np.arctan(temp + rh) - \
+        np.arctan(rh - 1.676331) + 0.00391838 * np.power(rh, 1.5) * np.arctan(0.023101 * rh) - 4.686035
+    return np.round(tw, 1)
+
+
+def wind_vector(wind_speed, wind_direction):
+    """
+    Returns the (u, v) vector the wind blows along, wind_direction is where it comes from.
+    """
+    direction = np.radians(wind_direction)
+    return -wind_speed * np.sin(direction), -wind_speed * np.cos(direction)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Broadcasting haversine distance in kilometers, inputs in degrees.
+    """
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def build_hourly_grid(responses, variables=None):
+    """
+    Stacks Open-Meteo history responses into one hourly weather array.
+
+    Responses that snapped to the same grid cell are only used once, like the
+    original per-sample loop did.
+
+    Args:
+    responses: List of Weather.history json responses covering the same dates.
+    variables: Grid variables in order, defaults to VARIABLES. Can add DERIVED_INPUTS.
+
+    Returns:
+    Tuple (hour_start, grid_lats, grid_lons, values) where hour_start is the
+    datetime of the first hour and values has shape (hours, points, variables).
+    """
+    if variables is None:
+        variables = VARIABLES
+    seen = set()
+    grid_lats = []
+    grid_lons = []
+    columns = []
+    times = None
+    for response in responses:
+        lanlon = (response['latitude'], response['longitude'])
+        if lanlon in seen:
+            continue
+        seen.add(lanlon)
+        hourly = response['hourly']
+        if times is None:
+            times = hourly['time']
+        series = {key: np.asarray(hourly[name], dtype=np.float64) for key, name in HOURLY_KEYS.items()}
+        series['wet_bulb'] = wet_bulb(series['temp'], series['humidity'])
+        if 'dew_point' in variables:
+            series['dew_point'] = np.asarray(hourly['dew_point_2m'], dtype=np.float64)
+        if 'wind_u' in variables or 'wind_v' in variables:
+            series['wind_u'], series['wind_v'] = wind_vector(series['wind_speed'], series['wind_direction'])
+        grid_lats.append(response['latitude'])
+        grid_lons.append(response['longitude'])
+        columns.append(np.stack([series[key][:len(times)] for key in variables], axis=-1))
+
+    if times is None:
+        raise ValueError("No weather responses to interpolate")
+
+    values = np.stack(columns, axis=1)
+    if np.isnan(values).any():
+        raise ValueError("Weather responses contain missing hourly values")
+
+    hour_start = datetime.strptime(times[0], '%Y-%m-%dT%H:%M')
+    return hour_start, np.asarray(grid_lats, dtype=np.float64), np.asarray(grid_lons, dtype=np.float64), values
+
+
+def interpolate(lats, lons, offsets, start_date_time, hour_start, grid_lats, grid_lons, values, samples=None,
+                neighbours=None, power=None):
+    """
+    Time-weighted inverse-distance blend for every sample and variable at once.
+
+    Every sample is blended between the two surrounding hours, weighted by how
+    close it is to each of them, and between its nearest grid points, weighted
+    by the inverse of the great-circle distance (see idw). A sample on top of
+    a grid point takes that point's values. Samples are blended in chunks of
+    idw.CHUNK_SIZE, so memory does not grow with the route.
+
+    Args:
+    lats: Latitudes of the stream samples in degrees.
+    lons: Longitudes of the stream samples in degrees.
+    offsets: Time offsets in seconds from start_date_time. When there are more
+        offsets than positions, the last position is reused.
+    start_date_time: Start datetime of the activity.
+    hour_start: Datetime of the first hour in values.
+    grid_lats: Latitudes of the weather grid points.
+    grid_lons: Longitudes of the weather grid points.
+    values: Hourly weather array of shape (hours, points, variables).
+    samples: Optional sample indices, only these samples are blended.
+    neighbours: Grid points blended per sample, defaults to IDW_NEIGHBOURS (0, all).
+    power: Power of the inverse distance, defaults to IDW_POWER (1).
+
+    Returns:
+    Array of shape (samples, variables).
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.float64)
+
+    position = np.minimum(np.arange(len(offsets)), len(lats) - 1)
+    if samples is not None:
+        position = position[samples]
+        offsets = offsets[samples]
+    index = idw.SphereIndex(grid_lats, grid_lons)
+
+    seconds = (start_date_time - hour_start).total_seconds() + offsets
+    hour_index = np.floor(seconds / 3600).astype(np.intp)
+    next_hour_contribution = (seconds - hour_index * 3600) / 3600
+    start_hour_contribution = 1 - next_hour_contribution
+
+    # Blending in chunks of samples keeps the (samples, points, variables) gathers small
+    blended = np.empty((len(offsets), values.shape[2]), dtype=np.float64)
+    for first in range(0, len(offsets), idw.CHUNK_SIZE):
+        chunk = slice(first, first + idw.CHUNK_SIZE)
+        weights, nearest = idw.neighbour_weights(index, lats[position[chunk]], lons[position[chunk]], k=neighbours,
+                                                 power=power)
+        hours = hour_index[chunk]
+        if nearest is None:
+            start_hour = np.einsum('np,npv->nv', weights, values[hours])
+            next_hour = np.einsum('np,npv->nv', weights, values[hours + 1])
+        else:
+            start_hour = np.einsum('nk,nkv->nv', weights, values[hours[:, None], nearest])
+            next_hour = np.einsum('nk,nkv->nv', weights, values[hours[:, None] + 1, nearest])
+        blended[chunk] = start_hour * start_hour_contribution[chunk, None] + \
+            next_hour * next_hour_contribution[chunk, None]
+    return blended
+
+def format_series(series):
+    return ', '.join(str(round(value, 1)) for value in series.tolist())
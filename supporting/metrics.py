@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Collects stage timings and counters for one invocation.
+
+    emit() prints them as a single CloudWatch embedded metric format (EMF)
+    json line, which CloudWatch turns into metrics without extra API calls.
+    The correlation id is added as a property so the record can be matched
+    with the log lines of the same invocation.
+    """
+
+    def __init__(self, handler='', correlation_id=None, namespace=None):
+        self.handler = handler
+        self.correlation_id = correlation_id
+        self.namespace = namespace or os.getenv('METRICS_NAMESPACE', 'StravaWeather')
+        self.timings = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.timings[stage] = self.timings.get(stage, 0) + elapsed
+
+    def add_timings(self, timings):
+        """
+        Adds stage timings in milliseconds measured elsewhere, like in a worker process.
+        """
+        with self.lock:
+            for stage, value in timings.items():
+                self.timings[stage] = self.timings.get(stage, 0) + value
+
+    def count(self, name, value=1):
+        if hasattr(value, 'item'):
+            # numpy scalars are not json serializable
+            value = value.item()
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self):
+        with self.lock:
+            timings = dict(self.timings)
+            counters = dict(self.counters)
+        timings['total'] = (time.perf_counter() - self.started) * 1000
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["handler"]],
+                    "Metrics": [{"Name": f"{stage}_ms", "Unit": "Milliseconds"} for stage in timings] +
+                               [{"Name": name, "Unit": "Bytes" if 'bytes' in name else "Count"}
+                                for name in counters]
+                }]
+            },
+            "handler": self.handler,
+            "correlation_id": self.correlation_id
+        }
+        for stage, value in timings.items():
+            record[f"{stage}_ms"] = round(value, 3)
+        record.update(counters)
+        return record
+
+    def emit(self):
+        if os.getenv('METRICS', 'on') == 'off':
+            return
+        print(json.dumps(self.record()), flush=True)
+
+
+current = Metrics()
+
+
+def start(handler='', correlation_id=None):
+    """
+    Starts collecting metrics for a new invocation and returns the collector.
+    """
+    global current
+    current = Metrics(handler=handler, correlation_id=correlation_id)
+    return current
+
+
+def timer(stage):
+    return current.timer(stage)
+
+
+def add_timings(timings):
+    current.add_timings(timings)
+
+
+def count(name, value=1):
+    current.count(name, value)
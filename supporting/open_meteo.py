@@ -1,11 +1,537 @@
-import requests
 import logging
-from datetime import datetime
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from supporting import metrics
 
 
-formatter = logging.Formatter('[%(levelname)s] %(message)s')
 log = logging.getLogger()
-log.setLevel("INFO")
+
+HOURLY_VARIABLES = ["temperature_2m", "apparent_temperature", "relative_humidity_2m", "weather_code", "wind_speed_10m",
+                    "wind_direction_10m", "dew_point_2m", "surface_pressure"]
+
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+
+
+def history_url(start_date):
+    current_date = datetime.now().date()
+
+    difference = (current_date - start_date).days
+    if difference <= 6:
+        return FORECAST_URL
+    return ARCHIVE_URL
+
+
+def trim_hours(measured_weather, start_hour, end_hour):
+    """
+    Keeps only the hourly values between start_hour and end_hour (inclusive).
+    """
+    hourly = measured_weather['hourly']
+    first = start_hour.strftime('%Y-%m-%dT%H:%M')
+    last = end_hour.strftime('%Y-%m-%dT%H:%M')
+    keep = [i for i, time in enumerate(hourly['time']) if first <= time <= last]
+    if len(keep) == 0:
+        measured_weather['hourly'] = {key: [] for key in hourly}
+        return measured_weather
+    start, end = keep[0], keep[-1] + 1
+    measured_weather['hourly'] = {key: values[start:end] for key, values in hourly.items()}
+    return measured_weather
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, refilled at rate tokens per second up to capacity.
+
+    A request for more tokens than capacity waits for a full bucket and then
+    leaves it in debt, so the callers after it wait until the debt is paid and
+    the long term rate never goes above rate.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        needed = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Open-Meteo allows 600 calls per minute, every location in a request counts as a call
+rate_limiter = TokenBucket(rate=float(os.getenv('OPEN_METEO_RATE', 8)),
+                           capacity=float(os.getenv('OPEN_METEO_BURST', 20)))
+
+
+class RequestCoalescer:
+    """
+    Merges concurrent requests for the same grid cell and date range into one fetch.
+
+    The first caller that claims a key fetches it, later callers for the same
+    key wait for that fetch and share its result (or its error). Keys are
+    released as soon as they are resolved, so this only joins requests that
+    overlap in time.
+    """
+
+    def __init__(self, grid=None):
+        if grid is None:
+            grid = float(os.getenv('OPEN_METEO_GRID', 0.1))
+        self.grid = grid
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def key(self, lat, lon, start_date, end_date, archive):
+        return round(float(lat) / self.grid), round(float(lon) / self.grid), start_date, end_date, archive
+
+    def claim(self, key):
+        """
+        Returns (pending, owner), owner is True when the caller has to fetch the key.
+        """
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is not None:
+                return pending, False
+            pending = {"done": threading.Event(), "result": None, "error": None}
+            self.pending[key] = pending
+            return pending, True
+
+    def resolve(self, key, result=None, error=None):
+        with self.lock:
+            pending = self.pending.pop(key)
+        pending["result"] = result
+        pending["error"] = error
+        pending["done"].set()
+
+    @staticmethod
+    def wait(pending):
+        pending["done"].wait()
+        if pending["error"] is not None:
+            raise pending["error"]
+        # Every waiter gets its own response dict, trim_hours replaces its hourly series
+        return dict(pending["result"])
+
+
+# Joins the identical requests of concurrent invocations, OPEN_METEO_COALESCE=off disables it
+coalescer = RequestCoalescer() if os.getenv('OPEN_METEO_COALESCE', 'on') != 'off' else None
+
+
+def map_concurrently(function, items, max_workers=None):
+    """
+    Calls function for every item on a bounded thread pool.
+
+    Args:
+    function: Callable taking one item.
+    items: List of items.
+    max_workers: Maximum number of concurrent calls, defaults to
+        OPEN_METEO_CONCURRENCY (4).
+
+    Returns:
+    List of results in the order of items.
+    """
+    if max_workers is None:
+        max_workers = int(os.getenv('OPEN_METEO_CONCURRENCY', 4))
+    if len(items) <= 1 or max_workers <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+session = None
+session_lock = threading.Lock()
+
+# Responses worth another try, Open-Meteo answers 429 when the rate limit is hit
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def get_session():
+    """
+    Returns the module level requests session, kept alive between warm invocations.
+
+    The session reuses TLS connections (keep-alive) and asks for gzip encoded
+    responses. Its connection pool is sized for OPEN_METEO_CONCURRENCY threads.
+    """
+    global session
+    with session_lock:
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            size = max(int(os.getenv('OPEN_METEO_CONCURRENCY', 4)), 1)
+            session = requests.Session()
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+    return session
+
+
+def backoff(attempt, response=None):
+    """
+    Seconds to wait before the next attempt: exponential backoff with full jitter.
+
+    A Retry-After header on the response is honoured when it asks for longer.
+    """
+    base = float(os.getenv('OPEN_METEO_BACKOFF', 0.5))
+    cap = float(os.getenv('OPEN_METEO_BACKOFF_MAX', 30))
+    wait = random.uniform(0, min(cap, base * 2 ** attempt))
+    if response is not None:
+        try:
+            wait = max(wait, min(cap, float(response.headers.get('Retry-After', 0))))
+        except ValueError:
+            pass
+    return wait
+
+
+def http_get(url, params):
+    """
+    GET through the shared session with timeouts and retries on 429/5xx and connection errors.
+
+    The number of retries is OPEN_METEO_RETRIES (4). The last response is
+    returned when all attempts got a retryable status, the last exception is
+    raised when all attempts failed to connect.
+    """
+    import requests
+
+    retries = int(os.getenv('OPEN_METEO_RETRIES', 4))
+    timeout = (float(os.getenv('OPEN_METEO_CONNECT_TIMEOUT', 3.05)), float(os.getenv('OPEN_METEO_READ_TIMEOUT', 30)))
+    for attempt in range(retries + 1):
+        try:
+            response = get_session().get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            wait = backoff(attempt)
+            log.warning(f"Open-Meteo request failed ({e}), retrying in {wait:.1f}s")
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                return response
+            wait = backoff(attempt, response)
+            log.warning(f"Open-Meteo answered {response.status_code}, retrying in {wait:.1f}s")
+        metrics.count('weather_retries')
+        time.sleep(wait)
+
+
+class OpenMeteoError(Exception):
+    """
+    Open-Meteo answered with an error, also after all retries of a 429/5xx.
+    """
+
+    def __init__(self, status_code, reason):
+        super().__init__(f"Open-Meteo request failed ({status_code}): {reason}")
+        self.status_code = status_code
+        self.reason = reason
+
+
+def split_days(measured_weather):
+    """
+    Splits the hourly series of a response into one dict of series per date.
+    """
+    hourly = measured_weather['hourly']
+    days = OrderedDict()
+    for i, hour in enumerate(hourly['time']):
+        day = days.setdefault(hour[:10], {key: [] for key in hourly})
+        for key, values in hourly.items():
+            day[key].append(values[i])
+    return days
+
+
+def join_days(latitude, longitude, days):
+    """
+    Builds a response shaped like Weather.history from cached days.
+    """
+    hourly = {}
+    for day in days:
+        for key, values in day.items():
+            hourly.setdefault(key, []).extend(values)
+    return {"latitude": latitude, "longitude": longitude, "hourly": hourly}
+
+
+class WeatherCache:
+    """
+    Two level cache for hourly Open-Meteo data, one entry per grid cell per day.
+
+    Entries are keyed by the grid snapped coordinates Open-Meteo returns. The
+    grid cell is remembered per square of grid degrees the requested location
+    falls in, like RequestCoalescer and HourlyStore key them, so a later
+    request anywhere in that square is answered without a call. A small in-process LRU
+    sits in front of a SQLite file that survives warm Lambda invocations.
+
+    Archive data never changes and is kept until it is evicted. Forecast data
+    expires after forecast_ttl seconds. When the file grows beyond max_bytes the
+    least recently used days are removed.
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_items=512, forecast_ttl=None, grid=None):
+        self.path = path or os.getenv('WEATHER_CACHE_PATH', '/tmp/open_meteo_cache.sqlite')
+        if grid is None:
+            grid = float(os.getenv('OPEN_METEO_GRID', 0.1))
+        self.grid = grid
+        if max_bytes is None:
+            max_bytes = int(os.getenv('WEATHER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        if forecast_ttl is None:
+            forecast_ttl = int(os.getenv('WEATHER_CACHE_FORECAST_TTL', 3600))
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.forecast_ttl = forecast_ttl
+        self.hits = 0
+        self.misses = 0
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS weather_days (latitude REAL, longitude REAL, day TEXT, "
+                        "archive INTEGER, fetched_at REAL, accessed_at REAL, size INTEGER, payload TEXT, "
+                        "PRIMARY KEY (latitude, longitude, day))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS weather_days_accessed ON weather_days (accessed_at)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS grid_squares (square_latitude INTEGER, square_longitude INTEGER, "
+                        "grid_latitude REAL, grid_longitude REAL, PRIMARY KEY (square_latitude, square_longitude))")
+        self.db.commit()
+
+    def square(self, lat, lon):
+        return round(float(lat) / self.grid), round(float(lon) / self.grid)
+
+    def valid(self, archive, fetched_at, want_archive):
+        if archive:
+            return True
+        if want_archive:
+            # Forecast data is not a substitute for the final archive values
+            return False
+        return time.time() - fetched_at < self.forecast_ttl
+
+    def grid_cell(self, lat, lon):
+        with self.lock:
+            row = self.db.execute("SELECT grid_latitude, grid_longitude FROM grid_squares "
+                                  "WHERE square_latitude = ? AND square_longitude = ?", self.square(lat, lon)).fetchone()
+            if row is None:
+                self.misses += 1
+        return row
+
+    def get(self, latitude, longitude, day, archive=True):
+        key = (latitude, longitude, day)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.db.execute("SELECT archive, fetched_at, payload FROM weather_days "
+                                      "WHERE latitude = ? AND longitude = ? AND day = ?", key).fetchone()
+                if row is not None:
+                    entry = (bool(row[0]), row[1], json.loads(row[2]))
+                    self.db.execute("UPDATE weather_days SET accessed_at = ? "
+                                    "WHERE latitude = ? AND longitude = ? AND day = ?", (time.time(),) + key)
+                    self.db.commit()
+                    self.remember(key, entry)
+            if entry is None or not self.valid(entry[0], entry[1], archive):
+                self.misses += 1
+                return None
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, latitude, longitude, day, hourly, archive=True):
+        key = (latitude, longitude, day)
+        payload = json.dumps(hourly, separators=(',', ':'))
+        now = time.time()
+        with self.lock:
+            self.remember(key, (archive, now, hourly))
+            self.db.execute("REPLACE INTO weather_days VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            key + (int(archive), now, now, len(payload), payload))
+            self.db.commit()
+
+    def put_grid_cell(self, lat, lon, latitude, longitude):
+        with self.lock:
+            self.db.execute("REPLACE INTO grid_squares VALUES (?, ?, ?, ?)", self.square(lat, lon) + (latitude, longitude))
+            self.db.commit()
+
+    def remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        with self.lock:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM weather_days").fetchone()[0]
+            removed = 0
+            while total > self.max_bytes:
+                rows = self.db.execute("SELECT latitude, longitude, day, size FROM weather_days "
+                                       "ORDER BY accessed_at LIMIT 100").fetchall()
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self.db.execute("DELETE FROM weather_days WHERE latitude = ? AND longitude = ? AND day = ?",
+                                    row[:3])
+                    self.memory.pop(row[:3], None)
+                    total -= row[3]
+                    removed += 1
+            self.db.commit()
+        if removed > 0:
+            log.info(f"Evicted {removed} days from the weather cache")
+        return removed
+
+    def stats(self):
+        with self.lock:
+            disk_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM weather_days").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "memory_items": len(self.memory), "disk_bytes": disk_bytes}
+
+
+weather_cache = None
+
+
+def get_cache():
+    """
+    Returns the module level cache, or None when WEATHER_CACHE=off.
+    """
+    global weather_cache
+    if os.getenv('WEATHER_CACHE', 'on') == 'off':
+        return None
+    if weather_cache is None:
+        weather_cache = WeatherCache()
+    return weather_cache
+
+
+def fetch_history(locations, start_date, end_date, cache=None, store=None):
+    """
+    Fetches the hourly history of the given locations, using the cache when possible.
+
+    Archive requests for locations in the hourly store are answered from it.
+    Locations whose grid cell is cached for every date are answered from the
+    cache. Locations that a concurrent call is already fetching for the same
+    dates wait for that result. All remaining locations are fetched in a
+    single request and stored.
+
+    Args:
+    locations: List of (lat, lon) tuples.
+    start_date: First date to fetch.
+    end_date: Last date to fetch (inclusive).
+    cache: WeatherCache to use, or None to always call Open-Meteo.
+    store: HourlyStore to read archived hours from, or None.
+
+    Returns:
+    List of responses shaped like Weather.history, one per location.
+    """
+    url = history_url(start_date)
+    archive = url == ARCHIVE_URL
+    days = [str(start_date + timedelta(days=i)) for i in range((end_date - start_date).days + 1)]
+
+    results = [None] * len(locations)
+    missing = []
+    for index, (lat, lon) in enumerate(locations):
+        if store is not None and archive:
+            measured_weather = store.history(lat, lon, start_date, end_date)
+            if measured_weather is not None:
+                results[index] = measured_weather
+                metrics.count('weather_store_hits')
+                continue
+        if cache is not None:
+            cell = cache.grid_cell(lat, lon)
+            if cell is not None:
+                cached = [cache.get(cell[0], cell[1], day, archive=archive) for day in days]
+                if all(day is not None for day in cached):
+                    results[index] = join_days(cell[0], cell[1], cached)
+                    metrics.count('weather_cache_hits')
+                    continue
+        missing.append(index)
+
+    # Locations another thread is already fetching are waited for instead of fetched
+    waiting = []
+    owned = {}
+    if coalescer is not None:
+        fetch = []
+        for index in missing:
+            key = coalescer.key(locations[index][0], locations[index][1], start_date, end_date, archive)
+            pending, owner = coalescer.claim(key)
+            if owner:
+                owned[index] = key
+                fetch.append(index)
+            else:
+                waiting.append((index, pending))
+        missing = fetch
+
+    error = Exception("Open-Meteo returned no result for a coalesced location")
+    try:
+        fetched = []
+        if len(missing) > 0:
+            fetched = request_history([locations[index] for index in missing], start_date, end_date, url)
+
+        for index, measured_weather in zip(missing, fetched):
+            results[index] = measured_weather
+            if index in owned:
+                coalescer.resolve(owned.pop(index), result=measured_weather)
+                results[index] = dict(measured_weather)
+            if cache is not None:
+                lat, lon = locations[index]
+                latitude = measured_weather['latitude']
+                longitude = measured_weather['longitude']
+                for day, hourly in split_days(measured_weather).items():
+                    cache.put(latitude, longitude, day, hourly, archive=archive)
+                cache.put_grid_cell(lat, lon, latitude, longitude)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Never leave a waiter hanging, keys that got no result share the failure
+        for key in owned.values():
+            coalescer.resolve(key, error=error)
+
+    for index, pending in waiting:
+        results[index] = coalescer.wait(pending)
+        metrics.count('weather_coalesced')
+
+    if cache is not None and len(missing) > 0:
+        cache.evict()
+    return results
+
+
+def request_history(locations, start_date, end_date, url):
+    """
+    Fetches the hourly history of the locations in a single Open-Meteo request.
+
+    Returns:
+    List of responses, one per location.
+    """
+    params = {
+        "latitude": ','.join(str(lat) for lat, lon in locations),
+        "longitude": ','.join(str(lon) for lat, lon in locations),
+        "hourly": HOURLY_VARIABLES,
+        "start_date": start_date,
+        "end_date": end_date
+    }
+
+    with metrics.timer('rate_limit_wait'):
+        rate_limiter.acquire(len(locations))
+    with metrics.timer('weather_request'):
+        response = http_get(url, params=params)
+    metrics.count('weather_requests')
+    metrics.count('weather_bytes', len(response.content))
+    try:
+        data = response.json()
+    except ValueError:
+        raise OpenMeteoError(response.status_code, response.text[:200])
+    if response.status_code >= 400 or (isinstance(data, dict) and data.get('error')):
+        raise OpenMeteoError(response.status_code, data.get('reason') if isinstance(data, dict) else data)
+    if isinstance(data, dict):
+        # A single location is returned as an object instead of a list
+        data = [data]
+    return data
 
 
 class Response:
@@ -17,9 +543,11 @@ class Response:
 
 
 class Weather:
-    def __init__(self, lon, lat):
+    def __init__(self, lon, lat, cache=None):
         self.long = lon
         self.lat = lat
+        # cache=False disables caching for this instance
+        self.cache = (get_cache() if cache is None else cache) or None
 
     def get(self, date=None):
         url = "https://api.open-meteo.com/v1/forecast"
@@ -30,30 +558,66 @@ class Weather:
             "start_date": date,
             "end_date": date
         }
-        response = requests.get(url, params=params)
+        response = http_get(url, params=params)
 
         return response.json()
 
     def history(self, start_date, end_date):
-        current_date = datetime.now().date()
+        return fetch_history([(self.lat, self.long)], start_date, end_date, cache=self.cache)[0]
 
-        difference = (current_date - start_date).days
-        if difference <= 6:
-            url = "https://api.open-meteo.com/v1/forecast"
-        else:
-            url = "https://archive-api.open-meteo.com/v1/archive"
 
-        params = {
-            "latitude": self.lat,
-            "longitude": self.long,
-            "hourly": ["temperature_2m", "apparent_temperature", "relative_humidity_2m", "weather_code", "wind_speed_10m", "wind_direction_10m", "dew_point_2m", "surface_pressure"],
-            "start_date": start_date,
-            "end_date": end_date
-        }
+def history_concurrently(weathers, start_date, end_date, max_workers=None):
+    """
+    Runs Weather.history for every Weather on a bounded thread pool.
 
-        response = requests.get(url, params=params)
-        # print(response.content)
-        # print(response.headers)
-        # print(response.status_code)
-        # print(response.reason)
-        return response.json()
+    Returns:
+    List of responses in the order of weathers.
+    """
+    return map_concurrently(lambda weather: weather.history(start_date, end_date), weathers, max_workers=max_workers)
+
+
+class WeatherBatch:
+    def __init__(self, locations, cache=None, max_locations=None, max_workers=None, store=None):
+        # locations is a list of (lat, lon) tuples
+        self.locations = locations
+        # Locations per request, larger batches are split and fetched concurrently
+        if max_locations is None:
+            max_locations = int(os.getenv('OPEN_METEO_MAX_LOCATIONS', 100))
+        self.max_locations = max_locations
+        self.max_workers = max_workers
+        # cache=False disables caching for this instance
+        self.cache = (get_cache() if cache is None else cache) or None
+        if store is None:
+            # The store imports this module, so it is only loaded here
+            from supporting.hourly_store import get_store
+            store = get_store()
+        # store=False skips the hourly store for this instance
+        self.store = store or None
+
+    def history(self, start_date_time, end_date_time):
+        """
+        Fetches the hourly history of all locations in a single request.
+
+        Open-Meteo accepts comma separated coordinates and returns one result
+        per location, in the same order. When there are more than
+        max_locations locations, the groups are fetched concurrently. The
+        hours are trimmed to the hour
+        before start_date_time up to the hour after end_date_time, which is all
+        the interpolation needs.
+
+        Args:
+        start_date_time: Start datetime of the activity.
+        end_date_time: End datetime of the activity.
+
+        Returns:
+        List of responses shaped like Weather.history, one per location.
+        """
+        start_hour = start_date_time.replace(minute=0, second=0, microsecond=0)
+        end_hour = end_date_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+        groups = [self.locations[i:i + self.max_locations] for i in range(0, len(self.locations), self.max_locations)]
+        results = map_concurrently(lambda group: fetch_history(group, start_hour.date(), end_hour.date(), cache=self.cache,
+                                                                 store=self.store),
+                                   groups, max_workers=self.max_workers)
+        data = [measured_weather for result in results for measured_weather in result]
+        return [trim_hours(measured_weather, start_hour, end_hour) for measured_weather in data]
@@ -0,0 +1,130 @@
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from supporting import aws
+
+
+log = logging.getLogger()
+
+MODES = {'cpu', 'memory'}
+
+
+def profile_modes(event=None):
+    """
+    Returns the profilers to run for an invocation, an empty set when profiling is off.
+
+    The "profile" key of the event wins over the PROFILE env var. Both take
+    "cpu" (cProfile), "memory" (tracemalloc), a comma separated combination,
+    or "on"/true for both.
+    """
+    value = event.get('profile') if isinstance(event, dict) else None
+    if value is None:
+        value = os.getenv('PROFILE', 'off')
+    if value is True or str(value).lower() in ('on', 'true', 'all'):
+        return set(MODES)
+    if value is False:
+        return set()
+    return {mode.strip() for mode in str(value).lower().split(',')} & MODES
+
+
+def write_dump(directory, name, write):
+    """
+    Writes one dump with write(path) to PROFILE_PATH, a local directory or s3://bucket/prefix.
+    """
+    if directory.startswith('s3://'):
+        bucket, _, prefix = directory[len('s3://'):].partition('/')
+        path = os.path.join('/tmp', name)
+        write(path)
+        result = aws.s3_upload(path, bucket, f"{prefix.rstrip('/')}/{name}".lstrip('/'))
+        os.remove(path)
+        if result != "ok":
+            log.error(f"Uploading profile {name} failed: {result}")
+            return None
+        return f"{directory.rstrip('/')}/{name}"
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    write(path)
+    return path
+
+
+@contextmanager
+def profile(name, correlation_id, modes, directory=None, top=None):
+    """
+    Runs the body under cProfile and/or tracemalloc and writes the results.
+
+    cpu writes a pstats file, memory a text file with the top allocation
+    sites and the peak. The file names hold name, the correlation id and the
+    start time, so they can be matched with the log lines of the invocation.
+
+    Args:
+    name: Name of the profiled handler.
+    correlation_id: Correlation id of the invocation.
+    modes: Set of profilers to run, see profile_modes.
+    directory: Where to write, defaults to PROFILE_PATH (/tmp/profiles).
+    top: Number of allocation sites, defaults to PROFILE_TOP (25).
+    """
+    if not modes:
+        yield
+        return
+    if directory is None:
+        directory = os.getenv('PROFILE_PATH', '/tmp/profiles')
+    if top is None:
+        top = int(os.getenv('PROFILE_TOP', 25))
+    tag = f"{name}-{correlation_id}-{time.strftime('%Y%m%dT%H%M%S')}"
+
+    profiler = None
+    if 'memory' in modes:
+        import tracemalloc
+        tracemalloc.start()
+    if 'cpu' in modes:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            path = write_dump(directory, f"{tag}.pstats", profiler.dump_stats)
+            log.info(f"Wrote cpu profile {path}")
+        if 'memory' in modes:
+            # Leave out what the profilers allocate themselves
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '*/cProfile.py'),
+                tracemalloc.Filter(False, '*/pstats.py'),
+            ])
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [f"peak {peak / 1024:.1f} KiB, current {current / 1024:.1f} KiB", ""]
+            lines += [str(statistic) for statistic in snapshot.statistics('lineno')[:top]]
+
+            def write(file_path):
+                with open(file_path, 'w') as file:
+                    file.write('\n'.join(lines) + '\n')
+            path = write_dump(directory, f"{tag}.allocations.txt", write)
+            log.info(f"Wrote memory profile {path}")
+
+
+def profiled(correlation_filter):
+    """
+    Decorator for a handler(event, context) that profiles invocations when asked to.
+
+    Every invocation first gets a fresh correlation id, so the logs, metrics
+    and dumps of warm invocations can be told apart. When profile_modes finds
+    nothing to run, the handler is called directly.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            correlation_filter.refresh(context)
+            modes = profile_modes(event)
+            if not modes:
+                return handler(event, context)
+            with profile(handler.__name__, correlation_filter.correlation_id, modes):
+                return handler(event, context)
+        return wrapper
+    return decorator
@@ -0,0 +1,29 @@
+import numpy as np
+
+
+def interval_indices(offsets, interval):
+    """
+    Sample indices at the first sample of every interval seconds, plus the last sample.
+
+    The weather is hourly data blended smoothly over time, so a value every
+    minute or so describes the activity as well as a value every second.
+    """
+    offsets = np.asarray(offsets)
+    if len(offsets) == 0:
+        return np.empty(0, dtype=np.int64)
+    buckets = offsets // interval
+    first = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    return np.unique(np.concatenate([first, [len(offsets) - 1]]))
+
+
+def change_indices(values, decimals=1):
+    """
+    Sample indices where the rounded value differs from the previous sample.
+
+    Holding every stored value until the next one gives back the rounded
+    series exactly.
+    """
+    rounded = np.round(np.asarray(values, dtype=np.float64), decimals)
+    if len(rounded) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.diff(rounded, prepend=np.nan) != 0)
@@ -0,0 +1,62 @@
+import logging
+import os
+
+import numpy as np
+
+from supporting.interpolation import haversine
+
+
+log = logging.getLogger()
+
+
+def select_locations(lats, lons, spacing_km=None, grid=None, max_points=None):
+    """
+    Picks the weather sample points of a route by distance travelled.
+
+    A point is taken at the start, every spacing_km along the route and at
+    the end. Points that fall in the same grid cell of grid degrees are
+    collapsed into the first one, so a short loop needs a single fetch while
+    a long ride gets a point in every cell it passes.
+
+    Args:
+    lats: Latitudes of the route in degrees.
+    lons: Longitudes of the route in degrees.
+    spacing_km: Distance between sample points, defaults to SAMPLE_SPACING_KM (5).
+    grid: Grid cell size in degrees, defaults to OPEN_METEO_GRID (0.1).
+    max_points: Maximum number of points, defaults to SAMPLE_MAX_POINTS (100).
+
+    Returns:
+    List of (lat, lon) tuples in route order.
+    """
+    if spacing_km is None:
+        spacing_km = float(os.getenv('SAMPLE_SPACING_KM', 5))
+    if grid is None:
+        grid = float(os.getenv('OPEN_METEO_GRID', 0.1))
+    if max_points is None:
+        max_points = int(os.getenv('SAMPLE_MAX_POINTS', 100))
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if len(lats) == 0:
+        return []
+
+    steps = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    travelled = np.concatenate([[0.0], np.cumsum(steps)])
+    marks = np.arange(0, travelled[-1], spacing_km)
+    indices = np.unique(np.concatenate([np.searchsorted(travelled, marks), [len(lats) - 1]]))
+
+    cells = set()
+    selected = []
+    for index in indices:
+        cell = (round(lats[index] / grid), round(lons[index] / grid))
+        if cell in cells:
+            continue
+        cells.add(cell)
+        selected.append((float(lats[index]), float(lons[index])))
+
+    if len(selected) > max_points:
+        keep = np.linspace(0, len(selected) - 1, max_points).round().astype(int)
+        selected = [selected[i] for i in np.unique(keep)]
+
+    log.info(f"Selected {len(selected)} weather sample points over {travelled[-1]:.1f} km")
+    return selected
@@ -0,0 +1,93 @@
+import warnings
+
+import numpy as np
+
+
+# Number of characters decoded per step, keeps the temporary memory bounded
+CHUNK_SIZE = 1 << 16
+
+
+def iter_chunks(text, separator, chunk_size=CHUNK_SIZE):
+    """
+    Yields slices of text of roughly chunk_size characters that end on a separator.
+
+    The separator at the cut is dropped, so every slice holds whole values.
+    """
+    start = 0
+    while start < len(text):
+        cut = text.find(separator, start + chunk_size)
+        if cut == -1:
+            yield text[start:]
+            return
+        yield text[start:cut]
+        start = cut + len(separator)
+
+
+def decode(text, separator, count, dtype, width=1, chunk_size=CHUNK_SIZE):
+    """
+    Decodes separated numbers into a preallocated array, one chunk at a time.
+
+    Args:
+    text: The stored stream text.
+    separator: Separator between the values (or value groups) in text.
+    count: Number of value groups in text.
+    dtype: Numpy dtype of the result.
+    width: Number of comma separated values per group.
+    chunk_size: Number of characters decoded per step.
+
+    Returns:
+    Array of shape (count,) or (count, width).
+
+    Raises:
+    ValueError when text holds something else than count numbers.
+    """
+    values = np.empty(count * width, dtype=dtype)
+    filled = 0
+    with warnings.catch_warnings():
+        # numpy before 2.0 only warns about text it can not parse and returns what it read
+        warnings.simplefilter('error', DeprecationWarning)
+        for chunk in iter_chunks(text, separator, chunk_size):
+            if separator != ',':
+                chunk = chunk.replace(separator, ',')
+            try:
+                decoded = np.fromstring(chunk, dtype=dtype, sep=',')
+            except (ValueError, DeprecationWarning) as err:
+                raise ValueError(f"Stream could not be decoded: {err}") from None
+            if filled + len(decoded) > len(values):
+                raise ValueError("Stream holds more values than expected")
+            values[filled:filled + len(decoded)] = decoded
+            filled += len(decoded)
+    if filled != len(values):
+        raise ValueError(f"Stream could not be decoded, got {filled} of {len(values)} values")
+    if width > 1:
+        return values.reshape(count, width)
+    return values
+
+
+def parse_times(text, chunk_size=CHUNK_SIZE):
+    """
+    Parses the stored time stream ("0,1,2,...") into int32 second offsets.
+    """
+    text = text.strip()
+    if text == '':
+        return np.empty(0, dtype=np.int32)
+    return decode(text, ',', text.count(',') + 1, np.int32, chunk_size=chunk_size)
+
+
+def parse_latlng(text, chunk_size=CHUNK_SIZE):
+    """
+    Parses the stored latlng stream ("[lat, lng],[lat, lng],...") into float64 arrays.
+
+    Like the original split based parser, everything up to the first "],["
+    is skipped and the closing "]" is dropped.
+
+    Returns:
+    Tuple (lats, lons).
+    """
+    start = text.find('],[')
+    end = text.rfind(']')
+    if start == -1 or end <= start:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+    body = text[start + 3:end]
+    points = decode(body, '],[', body.count('],[') + 1, np.float64, width=2, chunk_size=chunk_size)
+    return points[:, 0], points[:, 1]
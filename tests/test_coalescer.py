@@ -0,0 +1,81 @@
+import threading
+from datetime import date
+
+import pytest
+
+from benchmark.pipeline import Unlimited
+from benchmark.stubs import OpenMeteoStub
+from supporting import open_meteo
+
+DAY = date(2024, 7, 20)
+THREADS = 16
+
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    coalescer = open_meteo.RequestCoalescer()
+    monkeypatch.setattr(open_meteo, 'coalescer', coalescer)
+    monkeypatch.setattr(open_meteo, 'rate_limiter', Unlimited())
+    monkeypatch.delenv('WEATHER_STORE_PATH', raising=False)
+    monkeypatch.setenv('OPEN_METEO_RETRIES', '0')
+    return coalescer
+
+
+def start_stub(monkeypatch, **kwargs):
+    stub = OpenMeteoStub(latency=0.3, **kwargs).start()
+    monkeypatch.setattr(open_meteo, 'ARCHIVE_URL', f'{stub.url}/v1/archive')
+    monkeypatch.setattr(open_meteo, 'FORECAST_URL', f'{stub.url}/v1/forecast')
+    return stub
+
+
+def run_concurrently(count):
+    """
+    Requests the same location from count threads at once, returns (results, errors) per thread.
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = [None] * count
+
+    def request(i):
+        barrier.wait()
+        try:
+            # Slightly different coordinates in the same grid cell
+            results[i] = open_meteo.Weather(4.21 + i * 1e-4, 51.95, cache=False).history(DAY, DAY)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_identical_requests_make_one_upstream_call(coalescer, monkeypatch):
+    stub = start_stub(monkeypatch)
+    try:
+        results, errors = run_concurrently(THREADS)
+    finally:
+        stub.stop()
+
+    assert errors == [None] * THREADS
+    assert stub.calls == 1
+    assert all(result == results[0] for result in results)
+    # Every caller gets its own response dict
+    assert len({id(result) for result in results}) == THREADS
+    assert coalescer.pending == {}
+
+
+def test_upstream_failure_reaches_every_waiter(coalescer, monkeypatch):
+    stub = start_stub(monkeypatch, status=400)
+    try:
+        results, errors = run_concurrently(THREADS)
+    finally:
+        stub.stop()
+
+    assert stub.calls == 1
+    assert results == [None] * THREADS
+    assert all(isinstance(error, open_meteo.OpenMeteoError) for error in errors)
+    assert all(error.status_code == 400 for error in errors)
+    assert coalescer.pending == {}
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from src import main
+from supporting import profiling
+
+
+def test_every_invocation_gets_its_own_correlation_id(monkeypatch):
+    monkeypatch.setenv('PROFILE', 'off')
+    correlation_filter = main.CorrelationIdFilter()
+
+    @profiling.profiled(correlation_filter)
+    def handler(event, context):
+        return correlation_filter.correlation_id
+
+    first = handler({}, None)
+    second = handler({}, None)
+
+    assert first != second
+
+
+def test_correlation_id_is_the_lambda_request_id():
+    correlation_filter = main.CorrelationIdFilter()
+
+    correlation_filter.refresh(SimpleNamespace(aws_request_id='c6af9ac6-7b61-11e6-9a41-93e8deadbeef'))
+
+    assert correlation_filter.correlation_id == 'c6af9ac6-7b61-11e6-9a41-93e8deadbeef'
+
+
+def test_profile_dump_is_named_after_the_invocation(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROFILE_PATH', str(tmp_path))
+    correlation_filter = main.CorrelationIdFilter()
+
+    @profiling.profiled(correlation_filter)
+    def handler(event, context):
+        return None
+
+    handler({'profile': 'cpu'}, SimpleNamespace(aws_request_id='request-1'))
+    handler({'profile': 'cpu'}, SimpleNamespace(aws_request_id='request-2'))
+
+    names = sorted(path.name for path in tmp_path.iterdir())
+    assert len(names) == 2
+    assert 'request-1' in names[0] and 'request-2' in names[1]
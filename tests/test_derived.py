@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from supporting import derived, interpolation
+
+
+def response(latitude, longitude, wind_direction, dew_point):
+    hours = [f'2024-06-01T{hour:02d}:00' for hour in range(3)]
+    return {"latitude": latitude, "longitude": longitude, "hourly": {
+        "time": hours,
+        "temperature_2m": [20.0] * 3,
+        "apparent_temperature": [19.0] * 3,
+        "relative_humidity_2m": [60.0] * 3,
+        "wind_speed_10m": [10.0] * 3,
+        "wind_direction_10m": [wind_direction] * 3,
+        "dew_point_2m": [dew_point] * 3,
+        "surface_pressure": [1013.0] * 3
+    }}
+
+
+def blend(responses, lats, lons):
+    hour_start, grid_lats, grid_lons, values = interpolation.build_hourly_grid(responses, variables=derived.COLUMNS)
+    offsets = np.arange(len(lats)) * 60.0
+    start = datetime(2024, 6, 1, 0, 30)
+    blended = interpolation.interpolate(lats, lons, offsets, start, hour_start, grid_lats, grid_lons, values)
+    return blended, derived.compute(blended, lats, lons, offsets)
+
+
+def test_northerly_wind_is_blended_as_a_vector():
+    # Two grid points the same distance east and west of a route that heads north
+    lats = np.linspace(52.0, 52.01, 11)
+    lons = np.full(11, 5.0)
+    blended, series = blend([response(52.005, 4.9, 350.0, 10.0), response(52.005, 5.1, 10.0, 10.0)], lats, lons)
+
+    assert series['headwind'] == pytest.approx(np.full(11, 10 * np.cos(np.radians(10))), abs=1e-3)
+    assert series['crosswind'] == pytest.approx(np.zeros(11), abs=1e-3)
+    # The stored wind_direction column keeps the plain blend
+    assert blended[:, interpolation.VARIABLES.index('wind_direction')] == pytest.approx(np.full(11, 180.0))
+
+
+def test_tailwind_and_crosswind_signs():
+    lats = np.linspace(52.0, 52.01, 11)
+    lons = np.full(11, 5.0)
+    _, south = blend([response(52.005, 5.0, 180.0, 10.0)], lats, lons)
+    _, east = blend([response(52.005, 5.0, 90.0, 10.0)], lats, lons)
+
+    assert south['headwind'] == pytest.approx(np.full(11, -10.0))
+    assert east['crosswind'] == pytest.approx(np.full(11, 10.0))
+
+
+def test_dew_point_is_blended_from_the_grid():
+    lats = np.full(5, 52.0)
+    lons = np.full(5, 5.0)
+    _, series = blend([response(52.0, 4.9, 0.0, 8.0), response(52.0, 5.1, 0.0, 12.0)], lats, lons)
+
+    assert series['dew_point'] == pytest.approx(np.full(5, 10.0))
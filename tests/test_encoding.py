@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from database import encoding
+from supporting import resolution
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(2)
+    return 18 + np.cumsum(rng.normal(0, 0.02, 3600))
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_version_1_round_trip(series, compress):
+    data = encoding.encode_series(series, compress=compress)
+
+    assert encoding.is_binary(data)
+    assert data[2] == encoding.FORMAT_VERSION
+    np.testing.assert_array_equal(encoding.decode_series(data), np.round(series, 1))
+
+
+def test_version_1_reads_from_a_memoryview(series):
+    data = encoding.encode_series(series)
+
+    np.testing.assert_array_equal(encoding.decode_series(memoryview(data)), np.round(series, 1))
+
+
+def test_version_2_hold_mode_is_exact_against_the_rounded_series(series):
+    changes = resolution.change_indices(series)
+    data = encoding.encode_series(series[changes], indices=changes, count=len(series))
+
+    assert data[2] == encoding.SPARSE_FORMAT_VERSION
+    assert len(changes) < len(series)
+    np.testing.assert_array_equal(encoding.decode_series(data), np.round(series, 1))
+
+
+def test_version_2_linear_mode_interpolates_over_the_offsets():
+    # One sample per second with a ten minute pause halfway
+    offsets = np.concatenate([np.arange(0, 1800), np.arange(2400, 4200)])
+    series = 15 + offsets / 600
+    samples = resolution.interval_indices(offsets, 60)
+    data = encoding.encode_series(series[samples], indices=samples, count=len(offsets), linear=True)
+
+    decoded = encoding.decode_series(data, offsets=offsets)
+
+    assert decoded.shape == series.shape
+    np.testing.assert_array_equal(decoded[samples], np.round(series[samples], 1))
+    np.testing.assert_allclose(decoded, series, atol=0.05)
+    # Without the offsets the samples count as evenly spaced, which misplaces the pause
+    assert np.abs(encoding.decode_series(data) - series).max() > 0.5
+
+
+@pytest.mark.parametrize('data', ['20.1, 19.8, 20.0', b'20.1, 19.8, 20.0'])
+def test_legacy_text_rows(data):
+    np.testing.assert_array_equal(encoding.decode_series(data), [20.1, 19.8, 20.0])
+
+
+@pytest.mark.parametrize('data', [None, '', b''])
+def test_empty_rows(data):
+    assert len(encoding.decode_series(data)) == 0
+
+
+def test_values_outside_int16_fixed_point_raise():
+    with pytest.raises(ValueError):
+        encoding.encode_series([20.0, 3276.8])
+    with pytest.raises(ValueError):
+        encoding.encode_series([-3276.9])
+
+
+def test_unknown_version_raises(series):
+    data = bytearray(encoding.encode_series(series))
+    data[2] = 9
+
+    with pytest.raises(ValueError):
+        encoding.decode_series(bytes(data))
@@ -0,0 +1,93 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from benchmark.pipeline import Unlimited
+from benchmark.stubs import OpenMeteoStub
+from supporting import hourly_store, open_meteo
+from supporting.hourly_store import HourlyStore
+
+LAT, LON = 51.95, 4.21
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = OpenMeteoStub().start()
+    monkeypatch.setattr(open_meteo, 'ARCHIVE_URL', f'{stub.url}/v1/archive')
+    monkeypatch.setattr(open_meteo, 'FORECAST_URL', f'{stub.url}/v1/forecast')
+    monkeypatch.setattr(open_meteo, 'rate_limiter', Unlimited())
+    monkeypatch.setattr(open_meteo, 'coalescer', None)
+    monkeypatch.delenv('WEATHER_STORE_PATH', raising=False)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HourlyStore(path=str(tmp_path), grid=0.1)
+
+
+def assert_same_response(stored, fetched):
+    assert (stored['latitude'], stored['longitude']) == (fetched['latitude'], fetched['longitude'])
+    assert stored['hourly']['time'] == fetched['hourly']['time']
+    for name in open_meteo.HOURLY_VARIABLES:
+        np.testing.assert_array_equal(stored['hourly'][name], np.asarray(fetched['hourly'][name], dtype=np.float64))
+
+
+def test_filled_year_answers_like_the_network(stub, store):
+    assert store.fill(LAT, LON, 2023) is not None
+    assert store.complete(LAT, LON, 2023)
+
+    stored = store.history(LAT, LON, date(2023, 7, 20), date(2023, 7, 21))
+    fetched = open_meteo.Weather(LON, LAT, cache=False).history(date(2023, 7, 20), date(2023, 7, 21))
+
+    assert_same_response(stored, fetched)
+
+
+def test_range_across_a_new_year(stub, store):
+    store.prefetch([(LAT, LON)], [2022, 2023])
+
+    stored = store.history(LAT, LON, date(2022, 12, 31), date(2023, 1, 1))
+    fetched = open_meteo.Weather(LON, LAT, cache=False).history(date(2022, 12, 31), date(2023, 1, 1))
+
+    assert len(stored['hourly']['time']) == 48
+    assert_same_response(stored, fetched)
+
+
+def test_range_outside_the_stored_years_is_not_answered(stub, store):
+    store.fill(LAT, LON, 2023)
+
+    assert store.history(LAT, LON, date(2023, 12, 31), date(2024, 1, 1)) is None
+    assert store.history(LAT + 1, LON, date(2023, 7, 20), date(2023, 7, 20)) is None
+
+
+def test_partially_filled_year_returns_none(stub, store, monkeypatch):
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return cls(2023, 7, 20)
+
+    monkeypatch.setattr(hourly_store, 'date', Today)
+    store.fill(LAT, LON, 2023)
+
+    assert not store.complete(LAT, LON, 2023)
+    assert store.history(LAT, LON, date(2023, 7, 10), date(2023, 7, 12)) is not None
+    # Archive days newer than ARCHIVE_DELAY_DAYS are not stored yet
+    assert store.history(LAT, LON, date(2023, 7, 12), date(2023, 7, 14)) is None
+
+
+def test_stored_cells_need_no_http_calls(stub, store):
+    # The second location shares the grid square of the first
+    assert store.prefetch([(LAT, LON), (LAT + 0.02, LON + 0.02), (52.3, 4.9)], [2023]) == 2
+    calls = stub.calls
+
+    batch = open_meteo.WeatherBatch([(LAT, LON), (52.3, 4.9)], cache=False, store=store)
+    stored = batch.history(datetime(2023, 7, 20, 9, 17), datetime(2023, 7, 20, 13, 2))
+    assert stub.calls == calls
+
+    fetched = open_meteo.WeatherBatch([(LAT, LON), (52.3, 4.9)], cache=False, store=False) \
+        .history(datetime(2023, 7, 20, 9, 17), datetime(2023, 7, 20, 13, 2))
+    assert stub.calls == calls + 1
+    for stored_weather, fetched_weather in zip(stored, fetched):
+        assert_same_response(stored_weather, fetched_weather)
@@ -0,0 +1,61 @@
+import pytest
+
+from database import db
+
+
+class FakeCursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+
+class FakeCnx:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture
+def connection():
+    connection = db.Connection.__new__(db.Connection)
+    connection.cnx = FakeCnx()
+    return connection
+
+
+def test_unknown_mode_raises(connection):
+    with pytest.raises(ValueError):
+        connection.insert(table='weather', json_data=[{"activity_id": 1}], mode='upsrt')
+    assert connection.cnx.statements == []
+
+
+def test_single_mode_inserts_one_record(connection):
+    assert connection.insert(table='weather', json_data={"activity_id": 1, "temp": "20.1"})
+    assert connection.cnx.statements == [("INSERT INTO weather (activity_id, temp) VALUES (%s, %s)", (1, "20.1"))]
+
+
+def test_single_mode_inserts_a_list_of_records(connection):
+    rows = [{"activity_id": 1, "temp": "20.1"}, {"activity_id": 2, "temp": "18.4"}]
+
+    assert connection.insert(table='weather', json_data=rows, mode='single', transaction=True)
+
+    assert [params for query, params in connection.cnx.statements] == [(1, "20.1"), (2, "18.4")]
+    assert connection.cnx.commits == 1
+
+
+def test_upsert_mode_updates_on_duplicate_key(connection):
+    rows = [{"activity_id": 1, "temp": "20.1"}, {"activity_id": 2, "temp": "18.4"}]
+
+    assert connection.insert(table='weather', json_data=rows, mode='upsert')
+
+    query, params = connection.cnx.statements[0]
+    assert query == "INSERT INTO weather (activity_id, temp) VALUES (%s, %s), (%s, %s) " \
+                    "ON DUPLICATE KEY UPDATE temp = VALUES(temp)"
+    assert params == (1, "20.1", 2, "18.4")
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from supporting import idw, interpolation
+
+
+@pytest.mark.parametrize('neighbours', [0, 3])
+def test_chunked_blend_matches_a_single_chunk(monkeypatch, neighbours):
+    rng = np.random.default_rng(1)
+    lats = 52 + np.cumsum(rng.normal(0, 1e-3, 500))
+    lons = 4 + np.cumsum(rng.normal(0, 1e-3, 500))
+    offsets = np.arange(500) * 10.0
+    grid_lats = 52 + rng.uniform(-0.2, 0.2, 6)
+    grid_lons = 4 + rng.uniform(-0.2, 0.2, 6)
+    values = rng.normal(size=(4, 6, len(interpolation.VARIABLES)))
+    arguments = (lats, lons, offsets, datetime(2024, 6, 1, 6, 20), datetime(2024, 6, 1, 6), grid_lats, grid_lons,
+                 values)
+
+    whole = interpolation.interpolate(*arguments, neighbours=neighbours)
+    monkeypatch.setattr(idw, 'CHUNK_SIZE', 64)
+    chunked = interpolation.interpolate(*arguments, neighbours=neighbours)
+
+    assert whole.shape == (500, len(interpolation.VARIABLES))
+    np.testing.assert_allclose(chunked, whole, rtol=0, atol=1e-12)
@@ -0,0 +1,105 @@
+"""
+Compares the vectorized interpolation with the per-sample loop it replaced.
+"""
+import math
+from datetime import timedelta
+
+import pytest
+
+from benchmark.fixtures import FIXTURES, make_activity
+from benchmark.stubs import OpenMeteoStub
+from src import main
+from supporting import interpolation, sampling
+
+SERIES = ['temp', 'wet_bulb', 'wind_direction', 'wind_speed', 'apparent_temp', 'humidity', 'air_pressure']
+
+
+def reference_loop(latlng, times, start_date_time, responses):
+    """
+    The original lambda_handler loop: every sample blended by the product of distances between two hours.
+    """
+    activity_latlngs = latlng.split('],[')[1:]
+    activity_latlngs[-1] = activity_latlngs[-1][:-1]
+    activity_times = times.split(',')
+
+    all_measurements = {}
+    for measured_weather in responses:
+        hourly = measured_weather['hourly']
+        lanlon = f"{measured_weather['latitude']},{measured_weather['longitude']}"
+        for i, time in enumerate(hourly['time']):
+            all_measurements.setdefault(time, {})
+            if lanlon not in all_measurements[time]:
+                all_measurements[time][lanlon] = {
+                    "temp": hourly['temperature_2m'][i],
+                    "wet_bulb": main.calculate_wet_bulb(float(hourly['temperature_2m'][i]),
+                                                        float(hourly['relative_humidity_2m'][i])),
+                    "wind_direction": hourly['wind_direction_10m'][i],
+                    "wind_speed": hourly['wind_speed_10m'][i],
+                    "apparent_temp": hourly['apparent_temperature'][i],
+                    "humidity": hourly['relative_humidity_2m'][i],
+                    "air_pressure": hourly['surface_pressure'][i]
+                }
+
+    series = {name: [] for name in SERIES}
+    for t, activity_time in enumerate(activity_times):
+        position = activity_latlngs[min(t, len(activity_latlngs) - 1)]
+        lat_check = float(position.split(',')[0].strip())
+        lon_check = float(position.split(',')[1].strip())
+        datetime_compare = start_date_time + timedelta(seconds=int(activity_time))
+        start_of_hour = datetime_compare.replace(minute=0, second=0, microsecond=0)
+        start_of_next_hour = start_of_hour + timedelta(hours=1)
+        contributions = [(3600 - (datetime_compare - start_of_hour).total_seconds()) / 3600,
+                         (3600 - (start_of_next_hour - datetime_compare).total_seconds()) / 3600]
+        hours = [start_of_hour.strftime('%Y-%m-%dT%H:%M'), start_of_next_hour.strftime('%Y-%m-%dT%H:%M')]
+
+        values = {name: 0 for name in SERIES}
+        for hour, contribution in zip(hours, contributions):
+            distances = [main.haversine_afstand(lat_check, lon_check, *map(float, latlon.split(',')))
+                         for latlon in all_measurements[hour]]
+            distance_product = math.prod(distances)
+            totals = {name: 0 for name in SERIES}
+            total_parts = 0
+            for distance, measurement in zip(distances, all_measurements[hour].values()):
+                part = distance_product / distance
+                for name in SERIES:
+                    totals[name] += measurement[name] * part
+                total_parts += part
+            for name in SERIES:
+                values[name] += totals[name] / total_parts * contribution
+        for name in SERIES:
+            series[name].append(str(round(values[name], 1)))
+    return {name: ', '.join(values) for name, values in series.items()}
+
+
+@pytest.mark.parametrize('fixture', ['run_30min', 'ride_4h'])
+def test_interpolation_matches_the_original_loop(fixture, monkeypatch):
+    monkeypatch.setenv('IDW_NEIGHBOURS', '0')
+    duration, speed = FIXTURES[fixture]
+    activity, activity_streams = make_activity(1, duration, speed)
+    start_date_time = activity[9]
+    lats, lons, offsets = main.parse_streams({'time': activity_streams[2], 'latlng': activity_streams[5]})
+
+    stub = OpenMeteoStub()
+    try:
+        locations = sampling.select_locations(lats, lons)
+        # The first location twice, a grid cell that is returned again is only used once
+        locations = [locations[0]] + locations
+        end_date = start_date_time.date() + timedelta(days=1)
+        responses = stub.respond({'start_date': [str(start_date_time.date())], 'end_date': [str(end_date)],
+                                  'latitude': [','.join(str(lat) for lat, lon in locations)],
+                                  'longitude': [','.join(str(lon) for lat, lon in locations)]})
+    finally:
+        stub.server.server_close()
+    assert len({(response['latitude'], response['longitude']) for response in responses}) > 1
+
+    hour_start, grid_lats, grid_lons, values = interpolation.build_hourly_grid(responses)
+    blended = interpolation.interpolate(lats, lons, offsets, start_date_time, hour_start, grid_lats, grid_lons,
+                                        values)
+    expected = reference_loop(activity_streams[5], activity_streams[2], start_date_time, responses)
+
+    for i, name in enumerate(interpolation.VARIABLES):
+        actual = interpolation.format_series(blended[:, i]).split(', ')
+        mismatches = [(t, value, reference) for t, (value, reference)
+                      in enumerate(zip(actual, expected[name].split(', '))) if value != reference]
+        assert len(actual) == len(offsets)
+        assert mismatches[:5] == [], name
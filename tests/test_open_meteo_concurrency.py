@@ -0,0 +1,116 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+from benchmark.pipeline import Unlimited
+from benchmark.stubs import OpenMeteoStub
+from supporting import open_meteo
+
+DAY = date(2024, 7, 20)
+# Every location falls in its own 0.1 degree grid cell
+LOCATIONS = [(51.05 + i * 0.2, 4.05 + i * 0.3) for i in range(6)]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = OpenMeteoStub(latency=0.2).start()
+    monkeypatch.setattr(open_meteo, 'ARCHIVE_URL', f'{stub.url}/v1/archive')
+    monkeypatch.setattr(open_meteo, 'FORECAST_URL', f'{stub.url}/v1/forecast')
+    monkeypatch.setattr(open_meteo, 'rate_limiter', Unlimited())
+    monkeypatch.setattr(open_meteo, 'coalescer', None)
+    yield stub
+    stub.stop()
+
+
+def grid_cell(lat, lon):
+    # The cell the stub snaps a location to
+    return round(round(lat * 10) / 10 + 0.0125, 4), round(round(lon * 10) / 10 + 0.0375, 4)
+
+
+def test_history_concurrently_caps_the_requests_in_flight(stub):
+    weathers = [open_meteo.Weather(lon, lat, cache=False) for lat, lon in LOCATIONS]
+
+    open_meteo.history_concurrently(weathers, DAY, DAY, max_workers=2)
+
+    assert stub.calls == len(LOCATIONS)
+    assert stub.max_active == 2
+
+
+def test_concurrent_fetch_is_faster_than_one_by_one(stub):
+    weathers = [open_meteo.Weather(lon, lat, cache=False) for lat, lon in LOCATIONS]
+
+    started = time.monotonic()
+    open_meteo.history_concurrently(weathers, DAY, DAY, max_workers=len(LOCATIONS))
+    elapsed = time.monotonic() - started
+
+    assert elapsed < stub.latency * len(LOCATIONS) / 2
+
+
+def test_history_concurrently_returns_results_in_input_order(stub):
+    weathers = [open_meteo.Weather(lon, lat, cache=False) for lat, lon in LOCATIONS]
+
+    results = open_meteo.history_concurrently(weathers, DAY, DAY, max_workers=3)
+
+    assert [(result['latitude'], result['longitude']) for result in results] == \
+        [grid_cell(lat, lon) for lat, lon in LOCATIONS]
+
+
+def test_weather_batch_returns_results_in_input_order(stub):
+    batch = open_meteo.WeatherBatch(LOCATIONS, cache=False, store=False, max_locations=2, max_workers=3)
+
+    results = batch.history(start_date_time=datetime(2024, 7, 20, 9), end_date_time=datetime(2024, 7, 20, 11))
+
+    assert stub.calls == 3
+    assert [(result['latitude'], result['longitude']) for result in results] == \
+        [grid_cell(lat, lon) for lat, lon in LOCATIONS]
+
+
+def test_rate_limiter_paces_requests_to_the_stub(stub, monkeypatch):
+    monkeypatch.setattr(open_meteo, 'rate_limiter', open_meteo.TokenBucket(rate=10, capacity=1))
+    weathers = [open_meteo.Weather(lon, lat, cache=False) for lat, lon in LOCATIONS[:4]]
+
+    open_meteo.history_concurrently(weathers, DAY, DAY, max_workers=4)
+
+    arrivals = sorted(stub.arrivals)
+    # One token per request at 10 per second, the burst only covers the first one
+    assert arrivals[-1] - arrivals[0] >= 0.25
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = open_meteo.TokenBucket(rate=20, capacity=2)
+
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    elapsed = time.monotonic() - started
+
+    # Two tokens come from the burst, the other four take 1/20 s each
+    assert elapsed >= 0.18
+
+
+def test_token_bucket_charges_requests_larger_than_capacity_in_full():
+    bucket = open_meteo.TokenBucket(rate=50, capacity=5)
+
+    bucket.acquire(20)
+    started = time.monotonic()
+    bucket.acquire(1)
+    elapsed = time.monotonic() - started
+
+    # The 15 tokens of debt and the next token take 16/50 s to refill
+    assert elapsed >= 0.3
+
+
+def test_token_bucket_is_thread_safe():
+    bucket = open_meteo.TokenBucket(rate=100, capacity=5)
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(15)]
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    assert elapsed >= 0.09
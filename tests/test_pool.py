@@ -0,0 +1,173 @@
+import pytest
+
+from database import db
+
+
+class FakeError(Exception):
+    pass
+
+
+class FakeCnx:
+    """
+    Stand-in for a mysql-connector connection with the calls Connection makes.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.connected = True
+        self.connection_id = 1
+        # Whether a reconnect from ping succeeds
+        self.reachable = True
+        self.in_transaction = False
+        self.pings = 0
+        self.reconnects = 0
+        self.rollbacks = 0
+        self.fail_rollback = False
+        self.closed = False
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.pings += 1
+        if not self.connected and reconnect and self.reachable:
+            self.connected = True
+            self.connection_id += 1
+            self.reconnects += 1
+        if not self.connected:
+            raise FakeError("MySQL Connection not available.")
+
+    def rollback(self):
+        if self.fail_rollback or not self.connected:
+            raise FakeError("Lost connection to MySQL server")
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+        self.connected = False
+
+
+class FakeConnector:
+    """
+    Stand-in for the mysql.connector module.
+    """
+
+    Error = FakeError
+
+    def __init__(self):
+        self.connections = []
+        self.available = True
+
+    def connect(self, **settings):
+        if not self.available:
+            raise FakeError("Can't connect to MySQL server")
+        cnx = FakeCnx(settings)
+        self.connections.append(cnx)
+        return cnx
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    connector = FakeConnector()
+    monkeypatch.setattr(db, 'connector', lambda: connector)
+    return connector
+
+
+@pytest.fixture
+def pool(connector):
+    return db.ConnectionPool(user='user', password='secret', host='localhost', port=3306, charset='utf8mb4',
+                             size=1, max_idle=300)
+
+
+def test_acquire_opens_a_connection_with_the_pool_settings(pool, connector):
+    connection = pool.acquire()
+
+    assert isinstance(connection, db.Connection)
+    settings = connector.connections[0].settings
+    assert (settings['user'], settings['password'], settings['host'], settings['port'], settings['charset']) == \
+        ('user', 'secret', 'localhost', 3306, 'utf8mb4')
+
+
+def test_idle_connection_is_reused_after_a_ping(pool, connector):
+    connection = pool.acquire()
+    pool.release(connection)
+
+    assert pool.acquire() is connection
+    assert connection.cnx.pings == 1
+    assert len(connector.connections) == 1
+
+
+def test_released_connection_ends_its_transaction(pool):
+    connection = pool.acquire()
+    # A read without commit leaves the snapshot open
+    connection.cnx.in_transaction = True
+    pool.release(connection)
+
+    assert connection.cnx.rollbacks == 1
+    assert not connection.cnx.in_transaction
+    assert pool.acquire() is connection
+
+
+def test_connection_that_fails_the_rollback_is_discarded(pool):
+    connection = pool.acquire()
+    connection.cnx.fail_rollback = True
+    pool.release(connection)
+
+    assert pool.idle == []
+    assert connection.cnx.closed
+
+
+def test_dropped_connection_is_reconnected_by_the_ping(pool, connector):
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.cnx.connected = False
+
+    assert pool.acquire() is connection
+    assert connection.cnx.reconnects == 1
+    assert len(connector.connections) == 1
+
+
+def test_connection_idle_longer_than_max_idle_is_recycled(pool, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db.time, 'time', lambda: now[0])
+    connection = pool.acquire()
+    pool.release(connection)
+
+    now[0] += pool.max_idle + 1
+    fresh = pool.acquire()
+
+    assert fresh is not connection
+    assert connection.cnx.closed
+    assert connection.cnx.pings == 0
+
+
+def test_connection_that_fails_the_ping_is_discarded(pool, connector):
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.cnx.connected = False
+    connection.cnx.reachable = False
+
+    fresh = pool.acquire()
+
+    assert fresh is not connection
+    assert connection.cnx.closed
+    assert len(connector.connections) == 2
+
+
+def test_release_keeps_at_most_size_connections(pool):
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    assert [connection for connection, last_used in pool.idle] == [first]
+    assert second.cnx.closed
+    assert not first.cnx.closed
+
+
+def test_release_ignores_a_failed_connection(pool, connector):
+    connector.available = False
+    connection = pool.acquire()
+    assert connection.cnx is None
+
+    pool.release(connection)
+
+    assert pool.idle == []
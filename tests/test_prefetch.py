@@ -0,0 +1,21 @@
+import pytest
+
+from src import prefetch
+from supporting.hourly_store import HourlyStore
+
+
+def test_prefetch_requires_a_store_path(monkeypatch, capsys):
+    monkeypatch.delenv('WEATHER_STORE_PATH', raising=False)
+
+    with pytest.raises(SystemExit) as error:
+        prefetch.main(['--location', '51.95,4.21', '--years', '2024'])
+
+    assert error.value.code == 2
+    assert '--path is required' in capsys.readouterr().err
+
+
+def test_hourly_store_without_path_raises(monkeypatch):
+    monkeypatch.delenv('WEATHER_STORE_PATH', raising=False)
+
+    with pytest.raises(ValueError):
+        HourlyStore()
@@ -0,0 +1,114 @@
+import pytest
+
+from database import db
+
+QUERY = "SELECT id FROM activity WHERE id > %s ORDER BY id asc LIMIT %s"
+
+
+class FakePreparedCursor:
+    """
+    Prepares like mysql-connector's MySQLCursorPrepared: again whenever the query object changes.
+    """
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.executed = None
+        self.column_names = ('id',)
+        self.closed = False
+
+    def execute(self, operation, params=()):
+        if self.cnx.fail:
+            raise RuntimeError("Unknown prepared statement handler")
+        if operation is not self.executed:
+            self.executed = operation
+            self.cnx.prepares += 1
+        self.rows = [(params[0] + 1,)]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCnx:
+    def __init__(self):
+        self.cursors = []
+        self.prepares = 0
+        self.fail = False
+        self.connection_id = 1
+        # Whether the next ping finds the connection gone and reconnects
+        self.dropped = False
+
+    def cursor(self, prepared=False):
+        assert prepared
+        cursor = FakePreparedCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if self.dropped and reconnect:
+            self.dropped = False
+            self.connection_id += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def connection():
+    connection = db.Connection.__new__(db.Connection)
+    connection.cnx = FakeCnx()
+    connection.prepared = {}
+    return connection
+
+
+def select(connection, after_id):
+    # A new but equal query string every call, like an f-string in the caller
+    query = ' '.join(QUERY.split(' '))
+    return connection.get_specific(custom=query, params=(after_id, 10), prepared=True)
+
+
+def test_prepared_statement_is_reused_across_calls(connection):
+    assert select(connection, 1) == [(2,)]
+    assert select(connection, 5) == [(6,)]
+
+    assert len(connection.cnx.cursors) == 1
+    assert connection.cnx.prepares == 1
+
+
+def test_failed_statement_is_closed_and_prepared_again(connection):
+    select(connection, 1)
+    connection.cnx.fail = True
+    assert isinstance(select(connection, 1), Exception)
+    connection.cnx.fail = False
+
+    assert select(connection, 1) == [(2,)]
+    assert connection.cnx.cursors[0].closed
+    assert len(connection.cnx.cursors) == 2
+
+
+def test_oldest_statement_is_closed_beyond_the_limit(connection, monkeypatch):
+    monkeypatch.setattr(db, 'PREPARED_STATEMENTS', 2)
+    for after in ('1', '2', '3'):
+        connection.get_specific(custom=f"SELECT id FROM activity WHERE id > %s + {after}", params=(1,), prepared=True)
+
+    assert len(connection.prepared) == 2
+    assert [cursor.closed for cursor in connection.cnx.cursors] == [True, False, False]
+
+
+def test_reconnect_forgets_the_prepared_statements(connection):
+    select(connection, 1)
+    connection.cnx.dropped = True
+    assert connection.ping()
+
+    select(connection, 1)
+    assert len(connection.cnx.cursors) == 2
+
+
+def test_close_closes_the_prepared_statements(connection):
+    select(connection, 1)
+    connection.close()
+
+    assert connection.prepared == {}
+    assert connection.cnx.cursors[0].closed
@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from benchmark.fixtures import make_activity
+from benchmark.pipeline import Unlimited
+from benchmark.stubs import OpenMeteoStub, StubConnection
+from src import main
+from supporting import metrics, open_meteo
+
+
+@pytest.fixture
+def db(monkeypatch):
+    stub = OpenMeteoStub().start()
+    monkeypatch.setattr(open_meteo, 'ARCHIVE_URL', f'{stub.url}/v1/archive')
+    monkeypatch.setattr(open_meteo, 'FORECAST_URL', f'{stub.url}/v1/forecast')
+    monkeypatch.setattr(open_meteo, 'rate_limiter', Unlimited())
+    monkeypatch.setattr(open_meteo, 'coalescer', None)
+    monkeypatch.setenv('WEATHER_CACHE', 'off')
+    monkeypatch.delenv('WEATHER_STORE_PATH', raising=False)
+    db = StubConnection()
+    for activity_id in (1, 2):
+        activity, activity_streams = make_activity(activity_id, 1800, 3.0)
+        db.add('activity', activity)
+        db.add('activity_streams', activity_streams)
+    yield db
+    stub.stop()
+
+
+def test_worker_timings_reach_the_invocation_metrics(db):
+    invocation = metrics.start(handler='backfill')
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        failures = main.process_chunk(db, [(1, 1), (2, 2)], executor)
+
+    assert failures == []
+    assert len(db.tables[main.weather_table]) == 2
+    for stage in ('parse', 'fetch', 'blend_wait', 'interpolate', 'encode'):
+        assert invocation.timings.get(stage, 0) > 0, stage
+
+
+def test_rows_match_the_rows_without_workers(db):
+    main.process_chunk(db, [(1, 1), (2, 2)])
+    serial = db.tables.pop(main.weather_table)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        main.process_chunk(db, [(1, 1), (2, 2)], executor)
+
+    assert db.tables[main.weather_table] == serial
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from benchmark.fixtures import make_activity
+from supporting import streams
+
+pytestmark = pytest.mark.filterwarnings('error')
+
+
+def split_parser(text):
+    # The parser of the original handler
+    latlngs = text.split('],[')[1:]
+    latlngs[-1] = latlngs[-1][:-1]
+    return [float(latlng.split(',')[0].strip()) for latlng in latlngs], \
+        [float(latlng.split(',')[1].strip()) for latlng in latlngs]
+
+
+@pytest.fixture
+def activity_streams():
+    activity, activity_streams = make_activity(1, 600, 12)
+    return activity_streams[2], activity_streams[5]
+
+
+def test_first_position_is_skipped_like_the_split_parser():
+    lats, lons = streams.parse_latlng('[51.1, 4.1],[51.2, 4.2],[51.3, 4.3]')
+
+    np.testing.assert_array_equal(lats, [51.2, 51.3])
+    np.testing.assert_array_equal(lons, [4.2, 4.3])
+
+
+def test_latlng_matches_the_split_parser(activity_streams):
+    times, latlng = activity_streams
+    lats, lons = streams.parse_latlng(latlng)
+    expected_lats, expected_lons = split_parser(latlng)
+
+    assert len(lats) == len(times.split(',')) - 1
+    np.testing.assert_array_equal(lats, expected_lats)
+    np.testing.assert_array_equal(lons, expected_lons)
+
+
+@pytest.mark.parametrize('text', ['', '[51.1, 4.1]', '[]'])
+def test_latlng_without_a_second_position_is_empty(text):
+    lats, lons = streams.parse_latlng(text)
+
+    assert len(lats) == 0 and len(lons) == 0
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 4096])
+def test_chunk_size_does_not_change_the_arrays(activity_streams, chunk_size):
+    times, latlng = activity_streams
+
+    np.testing.assert_array_equal(streams.parse_times(times, chunk_size=chunk_size), streams.parse_times(times))
+    for chunked, whole in zip(streams.parse_latlng(latlng, chunk_size=chunk_size), streams.parse_latlng(latlng)):
+        np.testing.assert_array_equal(chunked, whole)
+
+
+def test_times_are_int32_offsets():
+    offsets = streams.parse_times('0,1,2,10')
+
+    assert offsets.dtype == np.int32
+    np.testing.assert_array_equal(offsets, [0, 1, 2, 10])
+    assert len(streams.parse_times('  ')) == 0
+
+
+@pytest.mark.parametrize('chunk_size', [2, streams.CHUNK_SIZE])
+@pytest.mark.parametrize('text', ['0,1,x,3', '0,1,,3', '0,1.5,2', '0,1,2,'])
+def test_malformed_times_raise(text, chunk_size):
+    with pytest.raises(ValueError):
+        streams.parse_times(text, chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [2, streams.CHUNK_SIZE])
+@pytest.mark.parametrize('text', ['[51.1, 4.1],[51.2, x],[51.3, 4.3]', '[51.1, 4.1],[51.2],[51.3, 4.3]',
+                                  '[51.1, 4.1],[51.2, 4.2, 7],[51.3, 4.3]'])
+def test_malformed_latlng_raises(text, chunk_size):
+    with pytest.raises(ValueError):
+        streams.parse_latlng(text, chunk_size=chunk_size)